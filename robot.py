@@ -1,10 +1,118 @@
 import math
 import random
-import matplotlib
-#matplotlib.use("TkAgg")
+import threading
+from array import array
 
-from ps3_visualize import *
-import pylab
+# Plotting (pylab) and animation (ps3_visualize) are imported only by the
+# functions that need them, so importing this module has no side effects.
+
+# Bump whenever a change alters simulation results, so that cached results
+# (see robot_cache) from older code are not reused.
+SIMULATION_VERSION = 4
+
+def generator_name():
+    """
+    Returns: 'numpy' or 'random'; the generator BufferedRandom draws its
+             blocks from, numpy's when numpy is installed. The same seed gives
+             different sequences with the two, so results are only
+             reproducible with the same generator.
+    """
+    # numpy is only imported once the first number is needed.
+    try:
+        import numpy
+    except ImportError:
+        return 'random'
+    return 'numpy'
+
+class BufferedRandom(threading.local):
+    """
+    A BufferedRandom hands out uniform random numbers that it draws from a
+    seedable generator in blocks of block_size, refilling transparently.
+    For a given seed, stream and generator (see generator_name) the sequence
+    is always the same.
+
+    Every thread has a sequence of its own, seeded separately and starting
+    unpredictably, so seeded trials run in different threads do not draw
+    from each other's sequences.
+    """
+    def __init__(self, seed=None, block_size=4096, stream=0):
+        """
+        seed: an int (seed >= 0) or None for an unpredictable sequence
+        block_size: an int (block_size > 0); how many numbers to draw at once
+        stream: an int (stream >= 0); generators with different streams give
+                independent sequences for the same seed
+        """
+        self.block_size = block_size
+        self.stream = stream
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Restarts this thread's sequence from seed, discarding any numbers
+        drawn ahead.
+        """
+        self.blocks = self._blocks(seed)
+        # The current block, reversed so that pop() hands its numbers out in
+        # order.
+        self.buffer = []
+
+    def random(self):
+        """
+        Returns: the next random float in [0, 1)
+        """
+        try:
+            return self.buffer.pop()
+        except IndexError:
+            return self._refill()
+
+    def _refill(self):
+        block = next(self.blocks)
+        block.reverse()
+        self.buffer = block
+        return block.pop()
+
+    def _blocks(self, seed):
+        if seed is not None and self.stream:
+            # Stream 0 keeps the plain seed; other streams mix theirs in.
+            seed = [seed, self.stream]
+        if generator_name() == 'random':
+            generator = random.Random(repr(seed) if isinstance(seed, list) else seed)
+            draw = generator.random
+            while True:
+                yield [draw() for i in range(self.block_size)]
+        import numpy
+        generator = numpy.random.default_rng(seed)
+        while True:
+            yield generator.random(self.block_size).tolist()
+
+    def uniform(self, a, b):
+        """
+        Returns: a random float between a and b
+        """
+        # Reads the buffer directly: every attribute lookup on a thread-local
+        # object costs a lookup of the thread's state.
+        try:
+            return a + (b - a) * self.buffer.pop()
+        except IndexError:
+            return a + (b - a) * self._refill()
+
+# The random numbers used by the robots and rooms. rng draws positions and
+# directions; event_rng decides the random events of CheapRobot and
+# SuperbRobot. Keeping the two apart means that, for the same seed, every
+# robot type starts from the same positions and turns to the same sequence of
+# directions (common random numbers, see compare_strategies). Seed both with
+# seed_random(seed).
+rng = BufferedRandom()
+event_rng = BufferedRandom(stream=1)
+
+def seed_random(seed):
+    """
+    Seeds the calling thread's rng and event_rng.
+
+    seed: an int (seed >= 0) or None for unpredictable sequences
+    """
+    rng.seed(seed)
+    event_rng.seed(seed)
 
 # === Provided class Position, do NOT change
 class Position(object):
@@ -63,7 +171,7 @@ class SimpleRoom(object):
     has some fixed amount of dirt. The tile is considered clean only when the amount
     of dirt on this tile is 0.
     """
-    def __init__(self, width, height, dirt_amount):
+    def __init__(self, width, height, dirt_amount, debug=False):
         """
         Initializes a rectangular room with the specified width, height, and
         dirt_amount on each tile.
@@ -71,14 +179,19 @@ class SimpleRoom(object):
         width: an integer > 0
         height: an integer > 0
         dirt_amount: an integer >= 0
+        debug: if True, get_num_cleaned_tiles cross-checks the running count of
+               clean tiles against a full scan of the room
         """
         self.width = width
         self.height = height
         self.dirt_amount = dirt_amount
+        self.debug = debug
         self.tiles_dirt = {}
         for p in range(self.width):
             for q in range(self.height):
                     self.tiles_dirt[(p, q)] = self.dirt_amount #Sets each tile's dirt amount to given amount.
+        # Running count of clean tiles, kept up to date by clean_tile_at_position.
+        self.num_cleaned_tiles = len(self.tiles_dirt) if self.dirt_amount == 0 else 0
 
     def clean_tile_at_position(self, pos, capacity):
         """
@@ -93,12 +206,30 @@ class SimpleRoom(object):
         Note: The amount of dirt on each tile should be NON-NEGATIVE.
               If the capacity exceeds the amount of dirt on the tile, mark it as 0.
         """
-        int_x = int(pos.get_x())
-        int_y = int(pos.get_y())
-        if capacity <= self.tiles_dirt[(int_x, int_y)]: #Removes capacity amount of dirt if capacity is less, otherwise removes all possible dirt.
-            self.tiles_dirt[(int_x, int_y)] -= capacity  
+        self.clean_tile_at_xy(pos.get_x(), pos.get_y(), capacity)
+
+    def clean_tile_at_xy(self, x, y, capacity):
+        """
+        Same as clean_tile_at_position, for the position with coordinates (x, y).
+        Lets robots clean without building a Position object.
+
+        x, y: floats
+        capacity: the amount of dirt to be cleaned; negative values add dirt
+        """
+        tile = (int(x), int(y))
+        old_dirt = self.tiles_dirt[tile]
+        if capacity <= old_dirt: #Removes capacity amount of dirt if capacity is less, otherwise removes all possible dirt.
+            new_dirt = old_dirt - capacity
         else:
-            self.tiles_dirt[(int_x, int_y)] = 0
+            new_dirt = 0
+        self.tiles_dirt[tile] = new_dirt
+        # Update the clean count when the tile crosses zero in either direction
+        # (negative capacities dirty a clean tile).
+        if old_dirt == 0:
+            if new_dirt != 0:
+                self.num_cleaned_tiles -= 1
+        elif new_dirt == 0:
+            self.num_cleaned_tiles += 1
 
     def is_tile_cleaned(self, m, n):
         """
@@ -118,6 +249,18 @@ class SimpleRoom(object):
         
     def get_num_cleaned_tiles(self):
         """
+        Returns: an integer; the total number of clean tiles in the room
+        """
+        if self.debug:
+            num_clean_tiles = self.count_cleaned_tiles()
+            assert num_clean_tiles == self.num_cleaned_tiles, \
+                "clean-tile counter is %d, full scan found %d" % (self.num_cleaned_tiles, num_clean_tiles)
+        return self.num_cleaned_tiles
+
+    def count_cleaned_tiles(self):
+        """
+        Counts the clean tiles by scanning every tile in the room.
+
         Returns: an integer; the total number of clean tiles in the room
         """
         num_clean_tiles = 0
@@ -134,9 +277,28 @@ class SimpleRoom(object):
         pos: a Position object.
         Returns: True if pos is in the room, False otherwise.
         """
-        x_cor = pos.get_x()
-        y_cor = pos.get_y()
+        return self.is_xy_in_room(pos.get_x(), pos.get_y())
+
+    def is_xy_in_room(self, x_cor, y_cor):
+        """
+        Same as is_position_in_room, for the position with coordinates
+        (x_cor, y_cor).
+
+        x_cor, y_cor: floats
+        Returns: True if the position is in the room, False otherwise.
+        """
         return (0 <= x_cor < self.width and 0 <= y_cor < self.height) #If both coordinates within range
+
+    def can_move(self, x, y, new_x, new_y):
+        """
+        Determines if a robot at (x, y), inside the room, can move in a
+        straight line to (new_x, new_y). The room is a rectangle, so that is
+        whether (new_x, new_y) is in the room.
+
+        x, y, new_x, new_y: floats
+        Returns: True if the move stays in the room, False otherwise.
+        """
+        return 0 <= new_x < self.width and 0 <= new_y < self.height
             
         
     def get_dirt_amount(self, m, n):
@@ -163,10 +325,360 @@ class SimpleRoom(object):
         """
         Returns: a Position object; a random position inside the room
         """
-        a = random.uniform(0,self.width)
-        b = random.uniform(0,self.height)
+        a = rng.uniform(0,self.width)
+        b = rng.uniform(0,self.height)
         return Position(a, b)
 
+class ChunkedRoom(SimpleRoom):
+    """
+    A ChunkedRoom is a SimpleRoom for very large rooms. Rather than one dict
+    entry per tile, dirt is stored in square chunks of chunk_size x chunk_size
+    tiles that are only allocated once one of their tiles changes; until then
+    every tile of a chunk holds the room's initial dirt_amount.
+
+    The room keeps a running count of clean tiles, so coverage stays O(1).
+    """
+    def __init__(self, width, height, dirt_amount, debug=False, chunk_size=64):
+        """
+        Initializes a rectangular room with the specified width, height, and
+        dirt_amount on each tile, without allocating any chunks.
+
+        width: an integer > 0
+        height: an integer > 0
+        dirt_amount: an integer >= 0
+        debug: as for SimpleRoom
+        chunk_size: an integer > 0; the side of a chunk, in tiles
+        """
+        self.width = width
+        self.height = height
+        self.dirt_amount = dirt_amount
+        self.debug = debug
+        self.chunk_size = chunk_size
+        # (m // chunk_size, n // chunk_size) -> array of the chunk's dirt, row m
+        # of the chunk first.
+        self.chunks = {}
+        self.num_cleaned_tiles = width * height if dirt_amount == 0 else 0
+
+    def _chunk_num_tiles(self, key):
+        """
+        Returns: the number of tiles of the chunk key that lie inside the room
+        (chunks on the far edges may be cut short)
+        """
+        size = self.chunk_size
+        return (min(size, self.width - key[0] * size) *
+                min(size, self.height - key[1] * size))
+
+    def _allocate_chunk(self, key):
+        chunk = array('q', [self.dirt_amount]) * (self.chunk_size * self.chunk_size)
+        self.chunks[key] = chunk
+        return chunk
+
+    def clean_tile_at_xy(self, x, y, capacity):
+        """
+        Same as SimpleRoom.clean_tile_at_xy; allocates the tile's chunk the
+        first time it is cleaned.
+        """
+        m = int(x)
+        n = int(y)
+        size = self.chunk_size
+        key = (m // size, n // size)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self._allocate_chunk(key)
+        index = (m % size) * size + n % size
+        old_dirt = chunk[index]
+        if capacity <= old_dirt:
+            new_dirt = old_dirt - capacity
+        else:
+            new_dirt = 0
+        chunk[index] = new_dirt
+        if old_dirt == 0:
+            if new_dirt != 0:
+                self.num_cleaned_tiles -= 1
+        elif new_dirt == 0:
+            self.num_cleaned_tiles += 1
+
+    def get_dirt_amount(self, m, n):
+        """
+        Return the amount of dirt on the tile (m, n)
+
+        Assumes that (m, n) represents a valid tile inside the room.
+
+        m: an integer
+        n: an integer
+
+        Returns: an integer
+        """
+        size = self.chunk_size
+        chunk = self.chunks.get((m // size, n // size))
+        if chunk is None:
+            return self.dirt_amount
+        return chunk[(m % size) * size + n % size]
+
+    def is_tile_cleaned(self, m, n):
+        """
+        Return True if the tile (m, n) has been cleaned.
+
+        Assumes that (m, n) represents a valid tile inside the room.
+        """
+        return self.get_dirt_amount(m, n) == 0
+
+    def count_cleaned_tiles(self):
+        """
+        Counts the clean tiles by scanning every allocated chunk; chunks never
+        allocated still hold dirt_amount on every tile.
+
+        Returns: an integer; the total number of clean tiles in the room
+        """
+        num_clean_tiles = 0
+        size = self.chunk_size
+        for key, chunk in self.chunks.items():
+            rows = min(size, self.width - key[0] * size)
+            columns = min(size, self.height - key[1] * size)
+            for row in range(rows):
+                start = row * size
+                num_clean_tiles += chunk[start:start + columns].count(0)
+        if self.dirt_amount == 0:
+            num_clean_tiles += self.width * self.height - sum(
+                self._chunk_num_tiles(key) for key in self.chunks)
+        return num_clean_tiles
+
+    def get_num_tiles(self):
+        """
+        Returns: an integer; the total number of tiles in the room
+        """
+        return self.width * self.height
+
+    def get_num_allocated_chunks(self):
+        """
+        Returns: an integer; the number of chunks allocated so far
+        """
+        return len(self.chunks)
+
+class FloorPlan(object):
+    """
+    A FloorPlan is the furniture of an ObstacleRoom, worked out from an
+    obstacle bitmap once so that the rooms of every trial can share it: an
+    occupancy raster, the list of free tiles and, the first time it is asked
+    for, the clearance of every tile (see get_clearance), which ObstacleRoom
+    uses to skip collision checks away from obstacles.
+    """
+    def __init__(self, obstacles):
+        """
+        obstacles: a sequence of rows of equal length, each a sequence of
+                   values; tile (m, n) is an obstacle if obstacles[n][m] is
+                   true
+        """
+        self.height = len(obstacles)
+        self.width = len(obstacles[0]) if obstacles else 0
+        if any(len(row) != self.width for row in obstacles):
+            raise ValueError('every row of the obstacle bitmap must have %d tiles' % self.width)
+        # occupied[m*height + n] is 1 if tile (m, n) is an obstacle.
+        self.occupied = bytearray(self.width * self.height)
+        self.free_tiles = []
+        for m in range(self.width):
+            for n in range(self.height):
+                if obstacles[n][m]:
+                    self.occupied[m*self.height + n] = 1
+                else:
+                    self.free_tiles.append((m, n))
+        self.clearance = None
+
+    def _compute_clearance(self):
+        """
+        Breadth-first search outwards from every obstacle, with the room
+        surrounded by a ring of obstacle tiles standing in for the walls.
+
+        Returns: an array; entry m*height + n is the clearance of tile (m, n)
+        """
+        width, height = self.width, self.height
+        # Padded grid, one tile bigger on every side: tile (m, n) is at
+        # (m + 1)*(height + 2) + n + 1.
+        stride = height + 2
+        unseen = -1
+        distance = array('l', [unseen]) * ((width + 2) * stride)
+        frontier = []
+        for p in range(width + 2):
+            for q in range(height + 2):
+                if (p in (0, width + 1) or q in (0, height + 1)
+                        or self.occupied[(p - 1)*height + q - 1]):
+                    distance[p*stride + q] = 0
+                    frontier.append(p*stride + q)
+        neighbours = [dp*stride + dq for dp in (-1, 0, 1) for dq in (-1, 0, 1) if dp or dq]
+        level = 0
+        while frontier:
+            level += 1
+            next_frontier = []
+            for index in frontier:
+                for offset in neighbours:
+                    neighbour = index + offset
+                    if 0 <= neighbour < len(distance) and distance[neighbour] == unseen:
+                        distance[neighbour] = level
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        clearance = array('l')
+        for m in range(width):
+            start = (m + 1)*stride + 1
+            clearance.extend(distance[start:start + height])
+        return clearance
+
+    def get_clearance(self, m, n):
+        """
+        Returns: an integer; the number of steps between tile (m, n) and the
+                 nearest obstacle or tile outside the room, moving to any of
+                 the 8 neighbouring tiles in a step (0 for an obstacle). A
+                 robot on a tile whose clearance exceeds its speed + 1 cannot
+                 hit anything on its next step.
+        """
+        return self.get_clearance_field()[m*self.height + n]
+
+    def get_clearance_field(self):
+        """
+        Returns: an array; entry m*height + n is the clearance of tile (m, n).
+                 It is computed the first time it is asked for. Do not
+                 modify it.
+        """
+        if self.clearance is None:
+            self.clearance = self._compute_clearance()
+        return self.clearance
+
+class ObstacleRoom(SimpleRoom):
+    """
+    An ObstacleRoom is a SimpleRoom with furniture: tiles marked in an
+    obstacle bitmap cannot be entered, hold no dirt and do not count towards
+    coverage.
+
+    The furniture is described by a FloorPlan, whose occupancy raster makes
+    checking a position O(1). A move is checked along its whole path, so
+    fast robots cannot hop over obstacles: a move starting on a tile whose
+    clearance exceeds the length of the move + 1 cannot reach an obstacle
+    and costs O(1); nearer the furniture, every tile the path crosses is
+    checked.
+
+    Use with run_simulation as room_type=functools.partial(ObstacleRoom,
+    obstacles=FloorPlan(bitmap)), so that every trial shares one FloorPlan.
+    """
+    def __init__(self, width, height, dirt_amount, obstacles, debug=False):
+        """
+        Initializes a rectangular room with the specified width, height, and
+        dirt_amount on each tile that is not an obstacle.
+
+        width: an integer > 0
+        height: an integer > 0
+        dirt_amount: an integer >= 0
+        obstacles: a FloorPlan of width x height tiles, or an obstacle bitmap
+                   as for FloorPlan, which is then worked out for this room
+                   alone
+        debug: as for SimpleRoom
+        """
+        if not isinstance(obstacles, FloorPlan):
+            obstacles = FloorPlan(obstacles)
+        if (obstacles.width, obstacles.height) != (width, height):
+            raise ValueError('the obstacle bitmap must have %d rows of %d tiles' % (height, width))
+        if not obstacles.free_tiles:
+            raise ValueError('the room has no free tiles')
+        self.width = width
+        self.height = height
+        self.dirt_amount = dirt_amount
+        self.debug = debug
+        self.plan = obstacles
+        self.occupied = obstacles.occupied
+        self.clearance = obstacles.get_clearance_field()
+        self.tiles_dirt = dict.fromkeys(obstacles.free_tiles, dirt_amount)
+        self.num_cleaned_tiles = len(self.tiles_dirt) if dirt_amount == 0 else 0
+
+    def get_clearance(self, m, n):
+        """
+        Returns: an integer; the clearance of tile (m, n), as for
+                 FloorPlan.get_clearance
+        """
+        return self.clearance[m*self.height + n]
+
+    def is_obstacle(self, m, n):
+        """
+        Returns: True if the tile (m, n) is an obstacle
+        """
+        return self.occupied[m*self.height + n] == 1
+
+    def is_xy_in_room(self, x_cor, y_cor):
+        """
+        Returns: True if the position (x_cor, y_cor) is in the room and not on
+                 an obstacle
+        """
+        return (0 <= x_cor < self.width and 0 <= y_cor < self.height
+                and not self.occupied[int(x_cor)*self.height + int(y_cor)])
+
+    def can_move(self, x, y, new_x, new_y):
+        """
+        Determines if a robot at (x, y), on a free tile, can move in a
+        straight line to (new_x, new_y) without leaving the room or crossing
+        an obstacle.
+
+        Returns: True if the move is clear, False otherwise.
+        """
+        if not self.is_xy_in_room(new_x, new_y):
+            return False
+        height = self.height
+        m = int(x)
+        n = int(y)
+        # A move of Chebyshev length d only crosses tiles within d + 1
+        # 8-neighbour steps of its starting tile.
+        if self.clearance[m*height + n] > max(abs(new_x - x), abs(new_y - y)) + 1:
+            return True
+        # Walk the tiles the path crosses, one grid line at a time.
+        occupied = self.occupied
+        end_m = int(new_x)
+        end_n = int(new_y)
+        dx = new_x - x
+        dy = new_y - y
+        step_m = 1 if dx > 0 else -1
+        step_n = 1 if dy > 0 else -1
+        # The fraction of the move at which the path crosses the next vertical
+        # and horizontal grid line, and the fraction between two such lines.
+        next_m = ((m + 1 if dx > 0 else m) - x) / dx if dx else math.inf
+        next_n = ((n + 1 if dy > 0 else n) - y) / dy if dy else math.inf
+        delta_m = abs(1 / dx) if dx else math.inf
+        delta_n = abs(1 / dy) if dy else math.inf
+        while m != end_m or n != end_n:
+            # Never step past the end tile, whatever the rounding.
+            if n == end_n or (m != end_m and next_m < next_n):
+                m += step_m
+                next_m += delta_m
+            else:
+                n += step_n
+                next_n += delta_n
+            if occupied[m*height + n]:
+                return False
+        return True
+
+    def get_random_position(self):
+        """
+        Returns: a Position object; a random position inside the room, off the
+                 obstacles
+        """
+        # Rejection sampling keeps positions uniform over the free area.
+        while True:
+            position = SimpleRoom.get_random_position(self)
+            if self.is_xy_in_room(position.x, position.y):
+                return position
+
+def parse_floor_plan(text):
+    """
+    Reads an obstacle bitmap for ObstacleRoom from text drawn as a floor plan:
+    one line per row of tiles, '#' for an obstacle and any other character,
+    spaces included, for a free tile. The last line is the row n = 0, as on a
+    plot. Empty lines before the first row and after the last are ignored.
+
+    text: a string
+    Returns: a list of rows of booleans
+    """
+    lines = text.splitlines()
+    while lines and not lines[-1]:
+        lines.pop()
+    while lines and not lines[0]:
+        lines.pop(0)
+    return [[c == '#' for c in line] for line in reversed(lines)]
+
 class Robot(object):
     """
     Represents a robot cleaning a particular room.
@@ -176,7 +688,18 @@ class Robot(object):
 
     Subclasses of Robot should provide movement strategies by implementing
     update_position_and_clean, which simulates a single time-step.
+
+    The displacement for one step at the robot's speed (delta_x, delta_y) is
+    cached whenever the direction is set, and the robot's Position is updated
+    in place, so stepping a robot allocates no objects. Subclasses declare
+    empty __slots__ to keep that compact layout.
+
+    stats is None, or an Instrumentation whose event counters the robot
+    updates as it moves.
     """
+    __slots__ = ('room', 'speed', 'capacity', 'position', 'direction', 'delta_x', 'delta_y',
+                 'stats')
+
     def __init__(self, room, speed, capacity):
         """
         Initializes a Robot with the given speed and given cleaning capacity in the
@@ -192,7 +715,8 @@ class Robot(object):
         self.speed = speed
         self.capacity = capacity
         self.position = room.get_random_position()
-        self.direction = random.uniform(0,360) 
+        self.set_robot_direction(rng.uniform(0,360))
+        self.stats = None
 
         
 
@@ -226,6 +750,30 @@ class Robot(object):
         direction: float representing an angle in degrees
         """
         self.direction = direction
+        # Same arithmetic as Position.get_new_position, done once per direction.
+        self.delta_y = self.speed * math.cos(math.radians(direction))
+        self.delta_x = self.speed * math.sin(math.radians(direction))
+
+    def _step_forward(self):
+        """
+        Moves the robot one step in its current direction if the new position
+        is in the room, and cleans the tile it arrives on.
+
+        Returns: True if the robot moved, False if it would have hit a wall.
+        """
+        position = self.position
+        x = position.x
+        y = position.y
+        new_x = x + self.delta_x
+        new_y = y + self.delta_y
+        if not self.room.can_move(x, y, new_x, new_y):
+            if self.stats is not None:
+                self.stats.count('wall_bounces')
+            return False
+        position.x = new_x
+        position.y = new_y
+        self.room.clean_tile_at_xy(new_x, new_y, self.capacity)
+        return True
 
     def update_position_and_clean(self):
         """
@@ -246,6 +794,8 @@ class StandardRobot(Robot):
     direction; when it would hit a wall, it *instead*
     chooses a new direction randomly.
     """
+    __slots__ = ()
+
     def update_position_and_clean(self):
         """
         Simulates the passage of a single time-step.
@@ -260,12 +810,8 @@ class StandardRobot(Robot):
         """
 # Calculate possible new position. See if position is valid. If valid, set robot position to new position.
 # If not valid, set direction to random direction and repeat process. 
-        new_position = self.position.get_new_position(self.direction, self.speed)
-        if self.room.is_position_in_room(new_position):
-            self.set_robot_position(new_position)
-            self.room.clean_tile_at_position(self.position, self.capacity)
-        else:
-            self.set_robot_direction(random.uniform(0,360))
+        if not self._step_forward():
+            self.set_robot_direction(rng.uniform(0,360))
 
 #test_robot_movement(StandardRobot, SimpleRoom)
 
@@ -276,6 +822,7 @@ class CheapRobot(Robot):
     dirty the tile it is on by dirty_amount units and pick a new, random direction for itself
     with probability p = 0.05 rather than simply cleaning the tile it moves to.
     """
+    __slots__ = ()
     p = 0.05
     dirty_amount = 1
 
@@ -305,7 +852,7 @@ class CheapRobot(Robot):
 
         returns: True if the robot drops dirt on its tile, False otherwise.
         """
-        return random.random() < CheapRobot.p
+        return event_rng.random() < CheapRobot.p
 
     def update_position_and_clean(self):
         """
@@ -322,18 +869,14 @@ class CheapRobot(Robot):
         
         # If the robot drops dirt,
         if self.drops_dirt():
-            self.room.clean_tile_at_position(self.get_robot_position(), -CheapRobot.dirty_amount)
-            self.set_robot_direction(random.uniform(0,360))
-        # If the robot does not drop dirt,
-        else:
-            new_position = self.position.get_new_position(self.direction, self.speed)
-            # Cleans tile in new position if valid. 
-            if self.room.is_position_in_room(new_position):
-                self.set_robot_position(new_position)
-                self.room.clean_tile_at_position(self.position, self.capacity)
-            # Otherwise changes direction.
-            else:
-                self.set_robot_direction(random.uniform(0,360))
+            if self.stats is not None:
+                self.stats.count('dirt_drops')
+            self.room.clean_tile_at_xy(self.position.x, self.position.y, -CheapRobot.dirty_amount)
+            self.set_robot_direction(rng.uniform(0,360))
+        # If the robot does not drop dirt, clean the tile in the new position
+        # if valid, otherwise change direction.
+        elif not self._step_forward():
+            self.set_robot_direction(rng.uniform(0,360))
 #test_robot_movement(CheapRobot, SimpleRoom)
 
 
@@ -352,6 +895,7 @@ class SuperbRobot(Robot):
     knock dust off of the wall.
 
     """
+    __slots__ = ()
     p = 0.1337
 
     @staticmethod
@@ -370,7 +914,7 @@ class SuperbRobot(Robot):
 
         returns: True if the SuperbRobot dirties the tile, False otherwise.
         """
-        return random.random() < SuperbRobot.p
+        return event_rng.random() < SuperbRobot.p
 
     def update_position_and_clean(self):
         """
@@ -395,45 +939,566 @@ class SuperbRobot(Robot):
         """
 
         # Possibility 1:
-        new_position = self.position.get_new_position(self.direction, self.speed)
-        if not self.room.is_position_in_room(new_position):
-            self.set_robot_direction(random.uniform(0,360))
-        # The 1st new position is in the room. Arrive at and clean this position.
-        else:  
-            self.set_robot_position(new_position)
-            self.room.clean_tile_at_position(self.position, self.capacity)
-            # Generate 2nd new position in same direction as before.
-            new_position = self.position.get_new_position(self.direction, self.speed) 
-            # Check if 2nd new position is valid. 
-            # If valid:
-            if self.room.is_position_in_room(new_position):
-                # The 2nd new position is in the room. Arrive at and clean this position.
-                self.set_robot_position(new_position)
-                self.room.clean_tile_at_position(self.position, self.capacity)
-            # If not valid:
-            else:
-                # Dirties Position A with probability p
-                if self.dirties_tile():
-                    # Dirties tile
-                    self.room.clean_tile_at_position(self.get_robot_position(), -1)
-                # Changes direction regardless. 
-                self.set_robot_direction(random.uniform(0,360))
+        if not self._step_forward():
+            self.set_robot_direction(rng.uniform(0,360))
+        # The 1st new position is in the room and has been cleaned. Try to
+        # arrive at and clean the 2nd new position in the same direction.
+        elif not self._step_forward():
+            # Dirties Position A with probability p
+            if self.dirties_tile():
+                # Dirties tile
+                if self.stats is not None:
+                    self.stats.count('superb_dirties')
+                self.room.clean_tile_at_xy(self.position.x, self.position.y, -1)
+            # Changes direction regardless. 
+            self.set_robot_direction(rng.uniform(0,360))
+        elif self.stats is not None:
+            self.stats.count('double_moves')
     
 
 
 #test_robot_movement(SuperbRobot, SimpleRoom)
 
+class RobotFleet(object):
+    """
+    A RobotFleet is a group of num_robots robots of one type cleaning the same
+    room, each independently placed and oriented.
+
+    The robots' state is kept in parallel arrays (x, y, direction and the
+    cached per-step displacement) rather than in separate Robot objects. Each
+    tick a single "cursor" robot of the fleet's type is loaded with one
+    robot's state, stepped by the type's own update_position_and_clean, and
+    stored back, so every robot type follows exactly its usual rules.
+
+    Only a robot's position and direction are kept per robot. Any other
+    attribute a robot type sets on itself while moving lives on the cursor
+    and is shared by every robot of the fleet, so robot types that keep
+    further per-robot state cannot be simulated as a fleet.
+    """
+    def __init__(self, room, robot_type, num_robots, speed, capacity):
+        """
+        Places num_robots robots of type robot_type at random positions and in
+        random directions in room, drawing the random numbers in the same order
+        as num_robots calls of robot_type(room, speed, capacity).
+
+        room: a SimpleRoom object
+        robot_type: a subclass of Robot
+        num_robots: an int (num_robots > 0)
+        speed: a float (speed > 0)
+        capacity: a positive integer
+        """
+        self.room = room
+        self.robot_type = robot_type
+        # Built without __init__ so that it draws no random numbers.
+        cursor = robot_type.__new__(robot_type)
+        cursor.room = room
+        cursor.speed = speed
+        cursor.capacity = capacity
+        # The Position the cursor is stepped from, reused for every robot.
+        self.position = Position(0.0, 0.0)
+        cursor.position = self.position
+        cursor.stats = None
+        self.cursor = cursor
+        self.xs = array('d')
+        self.ys = array('d')
+        self.directions = array('d')
+        self.deltas_x = array('d')
+        self.deltas_y = array('d')
+        for i in range(num_robots):
+            position = room.get_random_position()
+            cursor.set_robot_direction(rng.uniform(0,360))
+            self.xs.append(position.get_x())
+            self.ys.append(position.get_y())
+            self.directions.append(cursor.direction)
+            self.deltas_x.append(cursor.delta_x)
+            self.deltas_y.append(cursor.delta_y)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def get_robot_position(self, i):
+        """
+        Returns: a Position object giving the position of robot i
+        """
+        return Position(self.xs[i], self.ys[i])
+
+    def get_robot_direction(self, i):
+        """
+        Returns: a float giving the direction of robot i in degrees
+        """
+        return self.directions[i]
+
+    def set_robot_position(self, i, x, y):
+        """
+        Moves robot i to the position (x, y).
+        """
+        self.xs[i] = x
+        self.ys[i] = y
+
+    def set_robot_direction(self, i, direction):
+        """
+        Points robot i in direction (an angle in degrees).
+        """
+        cursor = self.cursor
+        cursor.set_robot_direction(direction)
+        self.directions[i] = direction
+        self.deltas_x[i] = cursor.delta_x
+        self.deltas_y[i] = cursor.delta_y
+
+    def update_position_and_clean(self):
+        """
+        Simulates the passage of a single time-step: every robot, in order,
+        moves and cleans according to the rules of the fleet's robot type.
+        """
+        cursor = self.cursor
+        position = self.position
+        xs, ys = self.xs, self.ys
+        directions, deltas_x, deltas_y = self.directions, self.deltas_x, self.deltas_y
+        step = cursor.update_position_and_clean
+        for i in range(len(xs)):
+            position.x = xs[i]
+            position.y = ys[i]
+            # Robots that move with set_robot_position replace the cursor's
+            # Position, so it is handed out afresh and read back every time.
+            cursor.position = position
+            direction = directions[i]
+            cursor.direction = direction
+            cursor.delta_x = deltas_x[i]
+            cursor.delta_y = deltas_y[i]
+            step()
+            moved_to = cursor.position
+            xs[i] = moved_to.x
+            ys[i] = moved_to.y
+            if cursor.direction is not direction:
+                directions[i] = cursor.direction
+                deltas_x[i] = cursor.delta_x
+                deltas_y[i] = cursor.delta_y
+
+# Class-level settings of the robot types, changed with e.g.
+# CheapRobot.set_dirt_probability, that alter simulation results.
+ROBOT_SETTINGS = ('p', 'dirty_amount')
+
+def get_robot_settings(robot_type):
+    """
+    Returns: a dictionary of the current values of the ROBOT_SETTINGS that
+             robot_type has
+    """
+    return {name: getattr(robot_type, name) for name in ROBOT_SETTINGS if hasattr(robot_type, name)}
+
+def set_robot_settings(robot_type, settings):
+    """
+    Restores settings, as returned by get_robot_settings, on robot_type.
+    """
+    for name, value in settings.items():
+        setattr(robot_type, name, value)
+
 # === Problem 5
+def _vectorized_params(robot_type):
+    """
+    Returns the keyword arguments describing robot_type to the array-backed
+    engine in robot_vectorized.
+
+    robot_type: StandardRobot, CheapRobot or SuperbRobot
+    """
+    if robot_type is StandardRobot:
+        return {'kind': 'standard'}
+    if robot_type is CheapRobot:
+        return {'kind': 'cheap', 'drop_probability': CheapRobot.p,
+                'dirty_amount': CheapRobot.dirty_amount}
+    if robot_type is SuperbRobot:
+        return {'kind': 'superb', 'drop_probability': SuperbRobot.p}
+    raise ValueError("the numpy engines do not support " + robot_type.__name__)
+
+def _straight_line_runs(room, x, y, delta_x, delta_y):
+    """
+    Walks a straight-line path from (x, y) in steps of (delta_x, delta_y) up to
+    the step that would take it out of the room.
+
+    Consecutive steps that land on the same tile are grouped, like the cells
+    of a grid traversal, so slow robots yield one entry per tile crossed.
+
+    Returns: (runs, x, y) where runs is a list of [tile, number of steps] in the
+             order visited and (x, y) is the last position reached.
+    """
+    runs = []
+    last_tile = None
+    # Accumulate exactly as Robot._step_forward does, so the positions match.
+    new_x = x + delta_x
+    new_y = y + delta_y
+    while room.can_move(x, y, new_x, new_y):
+        x = new_x
+        y = new_y
+        tile = (int(x), int(y))
+        if tile == last_tile:
+            runs[-1][1] += 1
+        else:
+            runs.append([tile, 1])
+            last_tile = tile
+        new_x = x + delta_x
+        new_y = y + delta_y
+    return runs, x, y
+
+def _record_crossings(coverages, order, k, coverage, steps, crossed_at):
+    """
+    Records steps in crossed_at for every threshold, taken in the sorted order
+    from position k on, that coverage has reached.
+
+    Returns: the position in order of the first threshold not yet reached
+    """
+    while k < len(order) and coverage >= coverages[order[k]]:
+        crossed_at[order[k]] = steps
+        k += 1
+    return k
+
+def _run_event_trial(num_robots, speed, capacity, width, height, dirt_amount, coverages,
+                     robot_type, seed=None, room_type=SimpleRoom):
+    """
+    Runs a single trial like run_trial_coverages, computing each StandardRobot's
+    straight-line segment, wall to wall, in one go.
+
+    A lone robot has its segment's cleanings applied in bulk and the clock
+    moved on by the segment's length. Coverage only rises when a tile becomes
+    clean, so the tick on which each threshold is crossed is worked out from
+    the step that cleaned the tile. With several robots, whose visits to a
+    tile must happen in tick order, each robot instead takes its next step off
+    its precomputed segment every tick. Either way the result is the same as
+    the 'python' engine for the same seed.
+    """
+    if robot_type is not StandardRobot:
+        raise ValueError("engine 'event' does not support " + robot_type.__name__)
+    if seed is not None:
+        seed_random(seed)
+    order = sorted(range(len(coverages)), key=coverages.__getitem__)
+    crossed_at = [0] * len(coverages)
+    room = room_type(width, height, dirt_amount)
+    fleet = RobotFleet(room, robot_type, num_robots, speed, capacity)
+    num_tiles = room.get_num_tiles()
+    # Coverage counts as 0 before the first tick and is measured after each tick.
+    k = _record_crossings(coverages, order, 0, 0, 0, crossed_at)
+    if num_robots > 1:
+        return _run_event_fleet(room, fleet, coverages, order, k, crossed_at)
+    k = _record_crossings(coverages, order, k, room.get_num_cleaned_tiles()/num_tiles, 1, crossed_at)
+    steps = 0
+    while k < len(order):
+        runs, x, y = _straight_line_runs(room, fleet.xs[0], fleet.ys[0],
+                                         fleet.deltas_x[0], fleet.deltas_y[0])
+        for tile, count in runs:
+            dirt = room.get_dirt_amount(tile[0], tile[1])
+            if dirt == 0:
+                # Nothing to clean; the run only passes time.
+                steps += count
+                continue
+            room.clean_tile_at_xy(tile[0], tile[1], capacity * count)
+            if capacity * count >= dirt:
+                # The tile became clean on step ceil(dirt / capacity) of the run.
+                cleaned_at = steps - (-dirt // capacity)
+                k = _record_crossings(coverages, order, k, room.get_num_cleaned_tiles()/num_tiles,
+                                      max(1, cleaned_at), crossed_at)
+                if k == len(order):
+                    return crossed_at
+            steps += count
+        fleet.set_robot_position(0, x, y)
+        # The next step would leave the room: the robot turns instead of moving.
+        steps += 1
+        fleet.set_robot_direction(0, rng.uniform(0,360))
+    return crossed_at
+
+def _run_event_fleet(room, fleet, coverages, order, k, crossed_at):
+    """
+    The several-robot case of _run_event_trial: every tick, each robot either
+    takes the next step of its precomputed segment or, at the end of it, turns
+    and computes its next segment.
+    """
+    num_tiles = room.get_num_tiles()
+    capacity = fleet.cursor.capacity
+    segments = [None] * len(fleet)
+    steps = 0
+    while k < len(order):
+        steps += 1
+        for i in range(len(fleet)):
+            segment = segments[i]
+            if segment is None:
+                runs, x, y = _straight_line_runs(room, fleet.xs[i], fleet.ys[i],
+                                                 fleet.deltas_x[i], fleet.deltas_y[i])
+                # [runs, index of the current run, steps left in it, end position]
+                segment = segments[i] = [runs, 0, runs[0][1] if runs else 0, x, y]
+            if segment[1] == len(segment[0]):
+                # The segment is used up: the robot turns instead of moving.
+                fleet.set_robot_position(i, segment[3], segment[4])
+                fleet.set_robot_direction(i, rng.uniform(0,360))
+                segments[i] = None
+                continue
+            tile = segment[0][segment[1]][0]
+            room.clean_tile_at_xy(tile[0], tile[1], capacity)
+            segment[2] -= 1
+            if segment[2] == 0:
+                segment[1] += 1
+                if segment[1] < len(segment[0]):
+                    segment[2] = segment[0][segment[1]][1]
+        k = _record_crossings(coverages, order, k, room.get_num_cleaned_tiles()/num_tiles,
+                              steps, crossed_at)
+    return crossed_at
+
+def trial_seed(seed, trial):
+    """
+    Returns the seed for trial number trial of a simulation seeded with seed.
+
+    Every trial draws its random numbers from its own seed, so a trial gives
+    the same result whichever process runs it and in whatever order.
+
+    seed: an int (seed >= 0)
+    trial: an int (trial >= 0)
+    """
+    return (seed << 32) + trial
+
+class Instrumentation(object):
+    """
+    Collects per-phase timings and event counts from instrumented trials (see
+    run_simulation's instrument argument).
+
+    The phases are 'move' (robot logic outside the room calls),
+    'bounds_check' (can_move), 'clean' (clean_tile_at_xy) and
+    'coverage_check'. The counters are 'wall_bounces', 'dirt_drops'
+    (CheapRobot.drops_dirt), 'superb_dirties' (SuperbRobot.dirties_tile) and
+    'double_moves' (SuperbRobot steps that moved twice).
+    """
+    PHASES = ('move', 'bounds_check', 'clean', 'coverage_check')
+    COUNTERS = ('wall_bounces', 'dirt_drops', 'superb_dirties', 'double_moves')
+
+    def __init__(self):
+        import time
+        self.clock = time.perf_counter
+        self.timers = dict.fromkeys(self.PHASES, 0.0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.trials = 0
+        self.ticks = 0
+        self.robot_steps = 0
+        # Time spent in whole ticks; 'move' is what is left of it after the
+        # room calls made during the ticks.
+        self.tick_time = 0.0
+
+    def count(self, name):
+        """
+        Adds one to the counter name.
+        """
+        self.counters[name] += 1
+
+    def time_tick(self, tick, num_robots):
+        """
+        Calls tick(), a tick of num_robots robot-steps, and adds up its time.
+        """
+        start = self.clock()
+        tick()
+        self.tick_time += self.clock() - start
+        self.ticks += 1
+        self.robot_steps += num_robots
+
+    def time_coverage(self, room):
+        """
+        Returns: room's coverage, timing the coverage check
+        """
+        start = self.clock()
+        coverage = float(room.get_num_cleaned_tiles()/room.get_num_tiles())
+        self.timers['coverage_check'] += self.clock() - start
+        return coverage
+
+    def report(self):
+        """
+        Returns: a dictionary with the number of 'trials', 'ticks' and
+                 'robot_steps', the 'timers' in seconds per phase and the
+                 event 'counters'
+        """
+        timers = dict(self.timers)
+        timers['move'] = max(0.0, self.tick_time - timers['bounds_check'] - timers['clean'])
+        return {'trials': self.trials, 'ticks': self.ticks, 'robot_steps': self.robot_steps,
+                'timers': timers, 'counters': dict(self.counters)}
+
+class _TimedRoom(object):
+    """
+    Wraps a room so that an Instrumentation times the bounds checks and
+    cleaning done through it. Everything else is passed through to the room.
+    """
+    def __init__(self, room, stats):
+        self.room = room
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.room, name)
+
+    def can_move(self, x, y, new_x, new_y):
+        clock = self.stats.clock
+        start = clock()
+        in_room = self.room.can_move(x, y, new_x, new_y)
+        self.stats.timers['bounds_check'] += clock() - start
+        return in_room
+
+    def clean_tile_at_xy(self, x, y, capacity):
+        clock = self.stats.clock
+        start = clock()
+        self.room.clean_tile_at_xy(x, y, capacity)
+        self.stats.timers['clean'] += clock() - start
+
+def new_trial(num_robots, speed, capacity, width, height, dirt_amount, robot_type, instrument=None,
+              room_type=SimpleRoom):
+    """
+    Sets up the room and robots of one trial of the 'python' engine.
+
+    instrument: an Instrumentation or None; if given, the robots report their
+                events and room calls to it
+    Other arguments are as for run_simulation.
+
+    Returns: (room, tick) where room is the trial's room_type room and calling
+             tick() simulates the passage of a single time-step
+    """
+    # Initialize room object
+    room = room_type(width, height, dirt_amount)
+    # Initializes the robots
+    fleet = RobotFleet(room, robot_type, num_robots, speed, capacity)
+    if instrument is not None:
+        fleet.cursor.room = _TimedRoom(room, instrument)
+        fleet.cursor.stats = instrument
+    return room, fleet.update_position_and_clean
+
+def run_trial(num_robots, speed, capacity, width, height, dirt_amount, min_coverage,
+              robot_type, engine='python', seed=None, instrument=None, room_type=SimpleRoom):
+    """
+    Runs a single trial of the simulation and returns the number of time-steps
+    needed to clean the fraction min_coverage of the room.
+
+    Arguments are as for run_simulation. seed, if not None, seeds the random
+    numbers drawn during the trial.
+    """
+    return run_trial_coverages(num_robots, speed, capacity, width, height, dirt_amount,
+                               [min_coverage], robot_type, engine, seed, instrument, room_type)[0]
+
+def run_trial_coverages(num_robots, speed, capacity, width, height, dirt_amount, coverages,
+                        robot_type, engine='python', seed=None, instrument=None,
+                        room_type=SimpleRoom):
+    """
+    Runs a single trial of the simulation until every fraction in coverages of
+    the room is clean.
+
+    coverages: a list of floats (0 <= coverage <= 1.0)
+    Other arguments are as for run_trial.
+
+    Returns: a list; for each entry of coverages, the first time-step at which
+             that fraction of the room was clean
+    """
+    if instrument is not None and engine != 'python':
+        raise ValueError("instrumentation is only supported by the 'python' engine")
+    if engine in ('numpy', 'batched') and room_type is not SimpleRoom:
+        raise ValueError('the numpy engines only simulate a SimpleRoom')
+    if engine == 'numpy':
+        from robot_vectorized import run_vectorized_trial
+        return run_vectorized_trial(num_robots, speed, capacity, width, height, dirt_amount,
+                                    coverages, rng=seed, **_vectorized_params(robot_type))
+    if engine == 'event':
+        return _run_event_trial(num_robots, speed, capacity, width, height, dirt_amount,
+                                coverages, robot_type, seed, room_type)
+    if engine != 'python':
+        raise ValueError('unknown engine: ' + repr(engine))
+
+    if seed is not None:
+        seed_random(seed)
+    # Visit the thresholds from lowest to highest, recording each as it is crossed.
+    order = sorted(range(len(coverages)), key=coverages.__getitem__)
+    crossed_at = [0] * len(coverages)
+    k = 0
+    steps = 0
+    room, tick = new_trial(num_robots, speed, capacity, width, height, dirt_amount, robot_type,
+                           instrument, room_type)
+    if instrument is not None:
+        instrument.trials += 1
+    coverage = 0
+    while True:
+        # Record every threshold that has now been achieved.
+        k = _record_crossings(coverages, order, k, coverage, steps, crossed_at)
+        if k == len(order):
+            return crossed_at
+        steps +=1
+        if instrument is not None:
+            instrument.time_tick(tick, num_robots)
+            coverage = instrument.time_coverage(room)
+            continue
+        tick()
+        # Update coverage.
+        coverage = float(room.get_num_cleaned_tiles()/room.get_num_tiles())
+
+def _run_trials(args, seeds, instrument=None, room_type=SimpleRoom, settings=None):
+    """
+    Runs one trial of run_trial_coverages(*args) per seed in seeds and returns
+    the list of their results. Used as the unit of work for process pools.
+
+    settings: None, or the robot type's settings (see get_robot_settings) to
+              run with; pool workers started by spawn or forkserver do not
+              inherit them from the parent
+    """
+    if settings is not None:
+        set_robot_settings(args[7], settings)
+    return [run_trial_coverages(*args, seed=seed, instrument=instrument, room_type=room_type)
+            for seed in seeds]
+
+def _simulate(num_robots, speed, capacity, width, height, dirt_amount, coverages, num_trials,
+              robot_type, engine, seed, workers, first_trial=0, instrument=None,
+              room_type=SimpleRoom):
+    """
+    Runs num_trials trials as described by run_simulation_coverages, numbered
+    from first_trial on (which only matters for seeding).
+
+    Returns: a list with one entry per trial, in trial order; each entry is the
+             list of time-steps at which the trial reached each coverage
+    """
+    if engine == 'batched':
+        if room_type is not SimpleRoom:
+            raise ValueError('the numpy engines only simulate a SimpleRoom')
+        from robot_vectorized import run_batched_trials
+        if seed is not None and first_trial:
+            seed = trial_seed(seed, first_trial)
+        crossed_at = run_batched_trials(num_robots, speed, capacity, width, height, dirt_amount,
+                                        coverages, num_trials, rng=seed,
+                                        **_vectorized_params(robot_type))
+        return crossed_at.tolist()
+
+    args = (num_robots, speed, capacity, width, height, dirt_amount, coverages,
+            robot_type, engine)
+    if seed is None and workers is not None and workers > 1:
+        seed = random.randrange(2**32)
+    if seed is None:
+        seeds = [None] * num_trials
+    else:
+        seeds = [trial_seed(seed, first_trial + i) for i in range(num_trials)]
+
+    if workers is None or workers <= 1:
+        return _run_trials(args, seeds, instrument, room_type)
+    if instrument is not None:
+        raise ValueError('instrumentation cannot be combined with workers')
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    # A few chunks per worker keeps the pool busy without paying per-trial overhead.
+    chunk_size = max(1, num_trials // (workers * 4))
+    results = [None] * num_trials
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        settings = get_robot_settings(robot_type)
+        futures = {pool.submit(_run_trials, args, seeds[i:i + chunk_size], None, room_type,
+                               settings): i
+                   for i in range(0, num_trials, chunk_size)}
+        # Slot each chunk's trials into place as the chunk finishes.
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i:i + chunk_size] = future.result()
+    return results
+
 def run_simulation(num_robots, speed, capacity, width, height, dirt_amount, min_coverage, num_trials,
-                  robot_type):
+                  robot_type, engine='python', seed=None, workers=None, cache=None,
+                  instrument=None, room_type=SimpleRoom):
     """
     Runs num_trials trials of the simulation and returns the mean number of
     time-steps needed to clean the fraction min_coverage of the room.
 
     The simulation is run with num_robots robots of type robot_type, each
     with the input speed and capacity in a room of dimensions width x height
-    with the dirt dirt_amount on each tile. Each trial is run in its own SimpleRoom
-    with its own robots.
+    with the dirt dirt_amount on each tile. Each trial is run in its own room
+    of type room_type with its own RobotFleet of independently placed robots.
 
     num_robots: an int (num_robots > 0)
     speed: a float (speed > 0)
@@ -445,51 +1510,92 @@ def run_simulation(num_robots, speed, capacity, width, height, dirt_amount, min_
     num_trials: an int (num_trials > 0)
     robot_type: class of robot to be instantiated (e.g. StandardRobot or
                 CheapRobot)
+    engine: 'python' to step robot_type objects in a SimpleRoom; 'event' to
+            jump a StandardRobot from wall to wall, giving the same result as
+            'python' in far fewer operations; 'numpy' to advance all robots at
+            once with the array-backed engine in robot_vectorized; or
+            'batched' to advance all trials at once in one array (the numpy
+            engines support StandardRobot, CheapRobot and SuperbRobot only)
+    seed: an int (seed >= 0) or None; if given, trial i is seeded with
+          trial_seed(seed, i) and the result is reproducible
+    workers: an int or None; if greater than 1, trials are spread over a pool
+             of that many processes. Without a seed, one is drawn at random so
+             that the workers do not repeat each other's trials. Not used by
+             the 'batched' engine, which draws every trial from one generator
+             seeded with seed.
+    cache: a robot_cache.ResultCache or None; if given, results are looked up
+           in and stored to the cache, keyed on the simulation parameters,
+           robot_type's settings (see get_robot_settings), seed,
+           generator_name() and SIMULATION_VERSION
+    instrument: an Instrumentation or None; if given, the trials' phase timings
+                and robot events are added to it (engine 'python' only, in
+                this process). Instrumented runs bypass the cache.
+    room_type: the class of room to simulate, called as room_type(width,
+               height, dirt_amount); SimpleRoom, ChunkedRoom, which gives
+               the same results for rooms too large for SimpleRoom, or e.g.
+               functools.partial(ObstacleRoom, obstacles=FloorPlan(bitmap)).
+               The numpy engines only support SimpleRoom, and other room
+               types than SimpleRoom and ChunkedRoom bypass the cache.
+    """
+    if cache is not None and instrument is None and room_type in (SimpleRoom, ChunkedRoom):
+        key = [robot_type.__name__, get_robot_settings(robot_type), num_robots, speed, capacity,
+               width, height, dirt_amount, min_coverage, num_trials, seed, engine,
+               generator_name(), SIMULATION_VERSION]
+        return cache.get_or_compute(key, lambda: run_simulation(
+            num_robots, speed, capacity, width, height, dirt_amount, min_coverage, num_trials,
+            robot_type, engine, seed, workers, room_type=room_type))
+    results = _simulate(num_robots, speed, capacity, width, height, dirt_amount, [min_coverage],
+                        num_trials, robot_type, engine, seed, workers, instrument=instrument,
+                        room_type=room_type)
+    return sum(steps[0] for steps in results)/num_trials
+
+def run_simulation_coverages(num_robots, speed, capacity, width, height, dirt_amount, coverages,
+                             num_trials, robot_type, engine='python', seed=None, workers=None,
+                             instrument=None, room_type=SimpleRoom):
     """
+    Like run_simulation, but answers several coverage thresholds at once. Each
+    trial runs until the highest threshold is reached and records the first
+    time-step at which every threshold was crossed along the way.
 
-    # Set steps to zero initially. 
-    steps = 0 
-    # Go through all the trials.
-    for i in range(num_trials):
-        # Initialize room object
-        room = SimpleRoom (width, height, dirt_amount)
-        # Initializes robot object
-        robot = robot_type(room, speed, capacity)
-        coverage = 0
-        # Check if minimum coverage has been achieved.       
-        while coverage < min_coverage:
-            steps +=1
-            # Update and clean for each robot
-            for i in range(num_robots):
-                robot.update_position_and_clean()
-            # Update coverage.
-            coverage = float(room.get_num_cleaned_tiles()/room.get_num_tiles())
-    return steps/num_trials
+    coverages: a list of floats (0 <= coverage <= 1.0)
+    Other arguments are as for run_simulation.
+
+    Returns: a dictionary mapping each coverage to a dictionary with keys
+             'mean': the mean number of time-steps needed to reach it, and
+             'steps': the list of time-steps each trial needed, in trial order
+    """
+    results = _simulate(num_robots, speed, capacity, width, height, dirt_amount, coverages,
+                        num_trials, robot_type, engine, seed, workers, instrument=instrument,
+                        room_type=room_type)
+    summary = {}
+    for k, coverage in enumerate(coverages):
+        steps = [crossed_at[k] for crossed_at in results]
+        summary[coverage] = {'mean': sum(steps)/num_trials, 'steps': steps}
+    return summary
        
 
             
 
 
-print ('avg time steps: ' + str(run_simulation(1, 1.0, 1, 5, 5, 3, 1.0, 50, StandardRobot)))
-print ('avg time steps: ' + str(run_simulation(1, 1.0, 1, 10, 10, 3, 0.8, 50, StandardRobot)))
-print ('avg time steps: ' + str(run_simulation(1, 1.0, 1, 10, 10, 3, 0.9, 50, StandardRobot)))
-print ('avg time steps: ' + str(run_simulation(1, 1.0, 1, 20, 20, 3, 0.5, 50, StandardRobot)))
-print ('avg time steps: ' + str(run_simulation(3, 1.0, 1, 20, 20, 3, 0.5, 50, StandardRobot)))
 
-def show_plot_compare_strategies(title, x_label, y_label):
+def show_plot_compare_strategies(title, x_label, y_label, cache=None):
     """
     Produces a plot comparing the three robot strategies in a 20x20 room with 80%
     minimum coverage.
+
+    cache: a robot_cache.ResultCache or None; points already in the cache are
+           not simulated again
     """
+    import pylab
     num_robot_range = range(1, 11)
     times1 = []
     times2 = []
     times3 = []
     for num_robots in num_robot_range:
         print ("Plotting", num_robots, "robots...")
-        times1.append(run_simulation(num_robots, 1.0, 1, 20, 20, 3, 0.8, 20, StandardRobot))
-        times2.append(run_simulation(num_robots, 1.0, 1, 20, 20, 3, 0.8, 20, CheapRobot))
-        times3.append(run_simulation(num_robots, 1.0, 1, 20, 20, 3, 0.8, 20, SuperbRobot))
+        times1.append(run_simulation(num_robots, 1.0, 1, 20, 20, 3, 0.8, 20, StandardRobot, cache=cache))
+        times2.append(run_simulation(num_robots, 1.0, 1, 20, 20, 3, 0.8, 20, CheapRobot, cache=cache))
+        times3.append(run_simulation(num_robots, 1.0, 1, 20, 20, 3, 0.8, 20, SuperbRobot, cache=cache))
     pylab.plot(num_robot_range, times1)
     pylab.plot(num_robot_range, times2)
     pylab.plot(num_robot_range, times3)
@@ -499,10 +1605,14 @@ def show_plot_compare_strategies(title, x_label, y_label):
     pylab.ylabel(y_label)
     pylab.show()
 
-def show_plot_room_shape(title, x_label, y_label):
+def show_plot_room_shape(title, x_label, y_label, cache=None):
     """
     Produces a plot showing dependence of cleaning time on room shape.
+
+    cache: a robot_cache.ResultCache or None; points already in the cache are
+           not simulated again
     """
+    import pylab
     aspect_ratios = []
     times1 = []
     times2 = []
@@ -511,9 +1621,9 @@ def show_plot_room_shape(title, x_label, y_label):
         height = int(300/width)
         print ("Plotting cleaning time for a room of width:", width, "by height:", height)
         aspect_ratios.append(float(width) / height)
-        times1.append(run_simulation(2, 1.0, 1, width, height, 3, 0.8, 200, StandardRobot))
-        times2.append(run_simulation(2, 1.0, 1, width, height, 3, 0.8, 200, CheapRobot))
-        times3.append(run_simulation(2, 1.0, 1, width, height, 3, 0.8, 200, SuperbRobot))
+        times1.append(run_simulation(2, 1.0, 1, width, height, 3, 0.8, 200, StandardRobot, cache=cache))
+        times2.append(run_simulation(2, 1.0, 1, width, height, 3, 0.8, 200, CheapRobot, cache=cache))
+        times3.append(run_simulation(2, 1.0, 1, width, height, 3, 0.8, 200, SuperbRobot, cache=cache))
     pylab.plot(aspect_ratios, times1, 'o-')
     pylab.plot(aspect_ratios, times2, 'o-')
     pylab.plot(aspect_ratios, times3, 'o-')
@@ -523,6 +1633,236 @@ def show_plot_room_shape(title, x_label, y_label):
     pylab.ylabel(y_label)
     pylab.show()
 
+class RunningStats(object):
+    """
+    Keeps the running count, mean and variance of a stream of numbers
+    (Welford's algorithm), without storing the numbers.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.sum_squares = 0.0
+
+    def add(self, value):
+        """
+        Adds value to the stream.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.sum_squares += delta * (value - self.mean)
+
+    def variance(self):
+        """
+        Returns: a float; the sample variance of the values added so far
+        """
+        if self.count < 2:
+            return float('inf')
+        return self.sum_squares / (self.count - 1)
+
+    def half_width(self, confidence):
+        """
+        Returns: a float; the half-width of the normal-approximation confidence
+                 interval for the mean at the given confidence level
+        """
+        from statistics import NormalDist
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        return z * math.sqrt(self.variance() / self.count)
+
+def run_simulation_adaptive(num_robots, speed, capacity, width, height, dirt_amount, min_coverage,
+                            robot_type, rel_precision=0.05, confidence=0.95, batch_size=20,
+                            max_trials=10000, engine='python', seed=None, workers=None,
+                            room_type=SimpleRoom):
+    """
+    Estimates the mean number of time-steps needed to clean the fraction
+    min_coverage of the room, running only as many trials as needed.
+
+    Trials are run in batches of batch_size while a running mean and variance
+    are kept. Once the confidence interval's half-width is at most
+    rel_precision times the mean, or max_trials trials have run, it stops.
+
+    rel_precision: a float (rel_precision > 0)
+    confidence: a float (0 < confidence < 1)
+    batch_size: an int (batch_size > 1)
+    max_trials: an int (max_trials >= batch_size)
+    Other arguments are as for run_simulation. With a seed, trial i is seeded
+    with trial_seed(seed, i) whatever batch it falls in.
+
+    Returns: a dictionary with keys 'mean', 'low' and 'high' (the bounds of
+             the confidence interval) and 'num_trials' (the trials used)
+    """
+    stats = RunningStats()
+    while stats.count < max_trials:
+        num_trials = min(batch_size, max_trials - stats.count)
+        for steps in _simulate(num_robots, speed, capacity, width, height, dirt_amount,
+                               [min_coverage], num_trials, robot_type, engine, seed, workers,
+                               first_trial=stats.count, room_type=room_type):
+            stats.add(steps[0])
+        if stats.half_width(confidence) <= rel_precision * abs(stats.mean):
+            break
+    half_width = stats.half_width(confidence)
+    return {'mean': stats.mean, 'low': stats.mean - half_width, 'high': stats.mean + half_width,
+            'num_trials': stats.count}
+
+def compare_strategies(num_robots, speed, capacity, width, height, dirt_amount, min_coverage,
+                       num_trials, robot_types=None, confidence=0.95, seed=None, workers=None,
+                       room_type=SimpleRoom):
+    """
+    Compares robot types with common random numbers: trial i of every type is
+    seeded alike, so all types start from the same positions and directions
+    and turn to the same sequence of directions. The difference between two
+    types in the same trial then has much less variance than the difference
+    between independent trials, and fewer trials give the same precision.
+
+    robot_types: a list of robot classes, or None for StandardRobot,
+                 CheapRobot and SuperbRobot; the first is the baseline
+    confidence: a float (0 < confidence < 1)
+    Other arguments are as for run_simulation (engine 'python'). Without a
+    seed, one is drawn at random and shared by every type.
+
+    Returns: a dictionary with keys 'num_trials', 'means' (robot type name ->
+             mean time-steps) and 'differences' (name of each other type ->
+             a dictionary with the 'mean', 'low' and 'high' of its paired
+             difference in time-steps from the baseline)
+    """
+    if robot_types is None:
+        robot_types = [StandardRobot, CheapRobot, SuperbRobot]
+    if seed is None:
+        seed = random.randrange(2**32)
+    steps = {}
+    for robot_type in robot_types:
+        results = _simulate(num_robots, speed, capacity, width, height, dirt_amount,
+                            [min_coverage], num_trials, robot_type, 'python', seed, workers,
+                            room_type=room_type)
+        steps[robot_type.__name__] = [crossed_at[0] for crossed_at in results]
+    baseline = steps[robot_types[0].__name__]
+    differences = {}
+    for robot_type in robot_types[1:]:
+        stats = RunningStats()
+        for a, b in zip(steps[robot_type.__name__], baseline):
+            stats.add(a - b)
+        half_width = stats.half_width(confidence)
+        differences[robot_type.__name__] = {'mean': stats.mean, 'low': stats.mean - half_width,
+                                            'high': stats.mean + half_width}
+    return {'num_trials': num_trials,
+            'means': {name: sum(values)/num_trials for name, values in steps.items()},
+            'differences': differences}
+
+ROBOT_TYPES = {'StandardRobot': StandardRobot, 'CheapRobot': CheapRobot, 'SuperbRobot': SuperbRobot}
+ROOM_TYPES = {'simple': SimpleRoom, 'chunked': ChunkedRoom}
+
+def print_examples():
+    """
+    Prints the mean cleaning times of a few example simulations.
+    """
+    print ('avg time steps: ' + str(run_simulation(1, 1.0, 1, 5, 5, 3, 1.0, 50, StandardRobot)))
+    # Coverage 0.8 and 0.9 of the 10x10 room come from the same trials.
+    for result in run_simulation_coverages(1, 1.0, 1, 10, 10, 3, [0.8, 0.9], 50, StandardRobot).values():
+        print ('avg time steps: ' + str(result['mean']))
+    print ('avg time steps: ' + str(run_simulation(1, 1.0, 1, 20, 20, 3, 0.5, 50, StandardRobot)))
+    print ('avg time steps: ' + str(run_simulation(3, 1.0, 1, 20, 20, 3, 0.5, 50, StandardRobot)))
+
+def main(argv=None):
+    """
+    Command-line entry point. Run with --help for the list of subcommands.
 
-show_plot_compare_strategies('Time to clean 80% of a 20x20 room, for various numbers of robots','Number of robots','Time (steps)')
-show_plot_room_shape('Time to clean 80% of a 300-tile room for various room shapes','Aspect Ratio', 'Time (steps)')
\ No newline at end of file
+    argv: a list of strings, or None to use sys.argv
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Simulate robots cleaning a room.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='run one simulation and print the mean time-steps')
+    run_parser.add_argument('--robot', choices=sorted(ROBOT_TYPES), default='StandardRobot')
+    run_parser.add_argument('--robots', type=int, default=1, help='number of robots')
+    run_parser.add_argument('--speed', type=float, default=1.0)
+    run_parser.add_argument('--capacity', type=int, default=1)
+    run_parser.add_argument('--width', type=int, default=10)
+    run_parser.add_argument('--height', type=int, default=10)
+    run_parser.add_argument('--dirt', type=int, default=3, help='dirt on each tile')
+    run_parser.add_argument('--coverage', type=float, action='append',
+                            help='minimum coverage; may be given several times (default 0.8)')
+    run_parser.add_argument('--trials', type=int, default=50)
+    run_parser.add_argument('--engine', choices=['python', 'event', 'numpy', 'batched'], default='python')
+    run_parser.add_argument('--seed', type=int)
+    run_parser.add_argument('--workers', type=int)
+    run_parser.add_argument('--room', choices=sorted(ROOM_TYPES), default='simple',
+                            help="room storage; 'chunked' for very large rooms")
+    run_parser.add_argument('--floor-plan',
+                            help="text file drawing the room, '#' for obstacles; sets the "
+                                 "width and height")
+    run_parser.add_argument('--instrument', action='store_true',
+                            help='print per-phase timings and robot event counts')
+
+    sweep_parser = subparsers.add_parser('sweep', help='run a parameter sweep and plot it')
+    sweep_parser.add_argument('sweep', choices=['strategies', 'room-shape'])
+    sweep_parser.add_argument('--cache', help='file of cached results to reuse and extend')
+
+    compare_parser = subparsers.add_parser('compare', help='compare robot types with paired trials')
+    compare_parser.add_argument('--robot', choices=sorted(ROBOT_TYPES), action='append',
+                                help='robot type; may be given several times, the first is the '
+                                     'baseline (default all three)')
+    compare_parser.add_argument('--robots', type=int, default=1, help='number of robots')
+    compare_parser.add_argument('--width', type=int, default=20)
+    compare_parser.add_argument('--height', type=int, default=20)
+    compare_parser.add_argument('--dirt', type=int, default=3, help='dirt on each tile')
+    compare_parser.add_argument('--coverage', type=float, default=0.8)
+    compare_parser.add_argument('--trials', type=int, default=20)
+    compare_parser.add_argument('--seed', type=int)
+    compare_parser.add_argument('--workers', type=int)
+
+    subparsers.add_parser('examples', help='print the mean time-steps of a few example runs')
+
+    visualize_parser = subparsers.add_parser('visualize', help='animate a robot cleaning a room')
+    visualize_parser.add_argument('--robot', choices=sorted(ROBOT_TYPES), default='StandardRobot')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        coverages = args.coverage or [0.8]
+        instrument = Instrumentation() if args.instrument else None
+        room_type = ROOM_TYPES[args.room]
+        if args.floor_plan:
+            import functools
+            with open(args.floor_plan) as f:
+                obstacles = parse_floor_plan(f.read())
+            args.height = len(obstacles)
+            args.width = len(obstacles[0])
+            room_type = functools.partial(ObstacleRoom, obstacles=FloorPlan(obstacles))
+        results = run_simulation_coverages(args.robots, args.speed, args.capacity, args.width,
+                                           args.height, args.dirt, coverages, args.trials,
+                                           ROBOT_TYPES[args.robot], args.engine, args.seed,
+                                           args.workers, instrument, room_type)
+        for coverage in coverages:
+            print ('coverage ' + str(coverage) + ': avg time steps: ' + str(results[coverage]['mean']))
+        if instrument is not None:
+            import json
+            print (json.dumps(instrument.report(), indent=2, sort_keys=True))
+    elif args.command == 'sweep':
+        cache = None
+        if args.cache:
+            from robot_cache import ResultCache
+            cache = ResultCache(args.cache)
+        if args.sweep == 'strategies':
+            show_plot_compare_strategies('Time to clean 80% of a 20x20 room, for various numbers of robots','Number of robots','Time (steps)', cache)
+        else:
+            show_plot_room_shape('Time to clean 80% of a 300-tile room for various room shapes','Aspect Ratio', 'Time (steps)', cache)
+    elif args.command == 'compare':
+        robot_types = [ROBOT_TYPES[name] for name in args.robot] if args.robot else None
+        result = compare_strategies(args.robots, 1.0, 1, args.width, args.height, args.dirt,
+                                    args.coverage, args.trials, robot_types, seed=args.seed,
+                                    workers=args.workers)
+        for name, mean in result['means'].items():
+            print ('%-14s avg time steps: %.1f' % (name, mean))
+        for name, difference in result['differences'].items():
+            print ('%-14s difference: %+.1f (95%% CI %+.1f to %+.1f)'
+                   % (name, difference['mean'], difference['low'], difference['high']))
+    elif args.command == 'examples':
+        print_examples()
+    elif args.command == 'visualize':
+        from ps3_visualize import test_robot_movement
+        test_robot_movement(ROBOT_TYPES[args.robot], SimpleRoom)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import robot
+
+# Throughput benchmarks for the robot simulation. A fixed matrix of scenarios,
+# one per engine, room size, robot count and robot type, is run with fixed
+# seeds through robot.run_simulation; results are saved as JSON so that two runs (say,
+# before and after a change) can be compared with the 'compare' command.
+
+ROOM_SIZES = [(10, 10), (20, 20), (50, 50)]
+ROBOT_COUNTS = [1, 5, 10]
+ROBOT_TYPES = ['StandardRobot', 'CheapRobot', 'SuperbRobot']
+ENGINES = ['python', 'event', 'numpy', 'batched']
+SEED = 6002
+
+# Metrics where a larger value is better; for every other metric (latencies
+# and memory) a smaller value is better.
+HIGHER_IS_BETTER = ('steps_per_sec', 'ticks_per_sec', 'trials_per_sec')
+
+
+def engines():
+    """
+    Returns: the entries of ENGINES that can run here; the numpy engines need
+             numpy to be installed
+    """
+    if robot.generator_name() == 'numpy':
+        return ENGINES
+    return [engine for engine in ENGINES if engine not in ('numpy', 'batched')]
+
+
+def scenarios(quick=False):
+    """
+    Returns: a list of dictionaries, one per benchmark scenario, with the
+             keyword arguments of robot.run_simulation (robot_type by name)
+             plus 'name'. The 'event' engine only runs StandardRobot.
+    """
+    room_sizes = ROOM_SIZES[:2] if quick else ROOM_SIZES
+    robot_counts = ROBOT_COUNTS[:2] if quick else ROBOT_COUNTS
+    result = []
+    for engine in engines():
+        for width, height in room_sizes:
+            for num_robots in robot_counts:
+                for robot_type in ROBOT_TYPES:
+                    if engine == 'event' and robot_type != 'StandardRobot':
+                        continue
+                    result.append({'name': '%s-%dx%d-%d-%s' % (robot_type, width, height,
+                                                                num_robots, engine),
+                                   'robot_type': robot_type, 'num_robots': num_robots,
+                                   'speed': 1.0, 'capacity': 1, 'width': width,
+                                   'height': height, 'dirt_amount': 3, 'min_coverage': 0.8,
+                                   'num_trials': 2 if quick else 5, 'engine': engine})
+    return result
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns: the nearest-rank percentile of the sorted list sorted_values
+    """
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _run_simulation(scenario, num_trials):
+    """
+    Runs num_trials trials of scenario with robot.run_simulation.
+
+    Returns: the total number of ticks the trials took
+    """
+    mean = robot.run_simulation(scenario['num_robots'], scenario['speed'], scenario['capacity'],
+                                scenario['width'], scenario['height'], scenario['dirt_amount'],
+                                scenario['min_coverage'], num_trials,
+                                robot.ROBOT_TYPES[scenario['robot_type']],
+                                engine=scenario['engine'], seed=SEED)
+    return int(round(mean * num_trials))
+
+
+def _run_trial(scenario, seed):
+    """
+    Runs one trial of scenario with robot.run_trial_coverages, seeded with
+    seed.
+    """
+    robot.run_trial_coverages(scenario['num_robots'], scenario['speed'], scenario['capacity'],
+                              scenario['width'], scenario['height'], scenario['dirt_amount'],
+                              [scenario['min_coverage']],
+                              robot.ROBOT_TYPES[scenario['robot_type']],
+                              engine=scenario['engine'], seed=seed)
+
+
+def run_scenario(scenario):
+    """
+    Benchmarks scenario.
+
+    Returns: a dictionary of metrics: robot-steps, ticks and trials per second,
+             trial latency percentiles in milliseconds, and the peak memory in
+             KiB allocated while running the trials. The 'batched' engine runs
+             its trials together, so it has no trial latencies.
+    """
+    num_trials = scenario['num_trials']
+    # An untimed warm-up, so that one-off costs such as lazy imports are not
+    # charged to whichever scenario happens to run first.
+    _run_simulation(scenario, 1)
+    # Throughput, as run_simulation delivers it.
+    start = time.perf_counter()
+    ticks = _run_simulation(scenario, num_trials)
+    elapsed = time.perf_counter() - start
+    metrics = {'steps_per_sec': ticks * scenario['num_robots'] / elapsed,
+               'ticks_per_sec': ticks / elapsed,
+               'trials_per_sec': num_trials / elapsed}
+    # Latency of individual trials, seeded as run_simulation seeds them.
+    if scenario['engine'] != 'batched':
+        trial_times = []
+        for i in range(num_trials):
+            start = time.perf_counter()
+            _run_trial(scenario, robot.trial_seed(SEED, i))
+            trial_times.append(time.perf_counter() - start)
+        trial_times.sort()
+        metrics['trial_p50_ms'] = percentile(trial_times, 0.50) * 1e3
+        metrics['trial_p90_ms'] = percentile(trial_times, 0.90) * 1e3
+        metrics['trial_p99_ms'] = percentile(trial_times, 0.99) * 1e3
+    # Memory is traced separately since tracing slows everything down.
+    tracemalloc.start()
+    _run_simulation(scenario, num_trials)
+    metrics['peak_memory_kib'] = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return metrics
+
+
+def run_benchmarks(quick=False, only=None):
+    """
+    Runs every scenario (or those whose name contains only) and returns the
+    results as a JSON-serializable dictionary.
+    """
+    results = {}
+    for scenario in scenarios(quick):
+        if only and only not in scenario['name']:
+            continue
+        results[scenario['name']] = run_scenario(scenario)
+        metrics = results[scenario['name']]
+        print('%-40s %12.0f steps/s  p50 %8.2f ms  p99 %8.2f ms  %8.1f KiB'
+              % (scenario['name'], metrics['steps_per_sec'],
+                 metrics.get('trial_p50_ms', float('nan')),
+                 metrics.get('trial_p99_ms', float('nan')), metrics['peak_memory_kib']))
+    return {'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'seed': SEED,
+                     'simulation_version': robot.SIMULATION_VERSION,
+                     'generator': robot.generator_name(), 'quick': quick},
+            'results': results}
+
+
+def compare(baseline, current, threshold):
+    """
+    Compares two benchmark results.
+
+    baseline, current: dictionaries as returned by run_benchmarks
+    threshold: a float; the relative change beyond which a metric counts as a
+               regression (0.1 means 10%)
+
+    Returns: a list of (scenario, metric, baseline value, current value,
+             relative change) for every regression
+    """
+    regressions = []
+    for name, metrics in sorted(current['results'].items()):
+        if name not in baseline['results']:
+            continue
+        for metric, value in sorted(metrics.items()):
+            old = baseline['results'][name].get(metric)
+            if not old:
+                continue
+            change = (value - old) / old
+            if metric in HIGHER_IS_BETTER:
+                regressed = change < -threshold
+            else:
+                regressed = change > threshold
+            if regressed:
+                regressions.append((name, metric, old, value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the robot simulation.')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='run the benchmark matrix')
+    run_parser.add_argument('--output', help='file to save the results to, as JSON')
+    run_parser.add_argument('--quick', action='store_true', help='run a smaller matrix')
+    run_parser.add_argument('--only', help='only run scenarios whose name contains this')
+    compare_parser = subparsers.add_parser('compare', help='flag regressions between two runs')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='relative change that counts as a regression (default 0.1)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.quick, args.only)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for name, metric, old, new, change in regressions:
+            print('REGRESSION %-40s %-16s %12.1f -> %12.1f (%+.1f%%)'
+                  % (name, metric, old, new, change * 100))
+        if regressions:
+            return 1
+        print('no regressions beyond %.0f%%' % (args.threshold * 100))
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import json
+import sqlite3
+
+# A small persistent memo table for simulation results. Entries live in a
+# local SQLite file so that repeated or extended parameter sweeps only need
+# to simulate the points they have not seen before.
+
+
+class ResultCache(object):
+    """
+    A ResultCache maps JSON-serializable keys to JSON-serializable results in
+    a file on disk.
+
+    The cache holds at most max_entries results; when it grows past that, the
+    least recently used entries are evicted.
+    """
+    def __init__(self, path='robot_cache.sqlite3', max_entries=10000):
+        """
+        Opens (creating if needed) the cache stored at path.
+
+        path: a string; the file backing the cache
+        max_entries: an int (max_entries > 0); the size cap of the cache
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                '(key TEXT PRIMARY KEY, value TEXT, last_used INTEGER)')
+        self.connection.commit()
+        # Recency is an increasing counter rather than a timestamp, so ties
+        # cannot happen and eviction order is exact.
+        row = self.connection.execute('SELECT MAX(last_used) FROM results').fetchone()
+        self.clock = row[0] or 0
+
+    @staticmethod
+    def make_key(key):
+        """
+        Returns: the string under which key is stored
+        """
+        return json.dumps(key, sort_keys=True)
+
+    def _touch(self):
+        self.clock += 1
+        return self.clock
+
+    def get(self, key, default=None):
+        """
+        Returns the result stored under key, or default if there is none.
+        A hit marks the entry as most recently used.
+        """
+        key = self.make_key(key)
+        row = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        self.connection.execute('UPDATE results SET last_used = ? WHERE key = ?',
+                                (self._touch(), key))
+        self.connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """
+        Stores value under key, evicting the least recently used entries if the
+        cache is over its size cap.
+        """
+        self.connection.execute('INSERT OR REPLACE INTO results (key, value, last_used) '
+                                'VALUES (?, ?, ?)',
+                                (self.make_key(key), json.dumps(value), self._touch()))
+        self.connection.execute('DELETE FROM results WHERE key NOT IN '
+                                '(SELECT key FROM results ORDER BY last_used DESC LIMIT ?)',
+                                (self.max_entries,))
+        self.connection.commit()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the result stored under key, calling compute() and storing its
+        result first if there is none.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        self.connection.execute('DELETE FROM results')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def __contains__(self, key):
+        row = self.connection.execute('SELECT 1 FROM results WHERE key = ?',
+                                      (self.make_key(key),)).fetchone()
+        return row is not None
@@ -0,0 +1,280 @@
+import argparse
+import collections
+import json
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import robot
+import robot_sweep
+
+# Parameter sweeps spread over worker processes, possibly on other machines.
+# A coordinator splits the sweep into batches of trials and hands them out
+# over TCP; workers connect, take a batch, run it and send back the
+# time-steps of each trial. The coordinator merges results as they stream in.
+#
+# Each batch handed out is leased to its worker. If the worker's connection
+# drops, or the lease runs out before the batch comes back, the batch goes
+# back on the queue for another worker. Trials are seeded with
+# robot.trial_seed(seed, i), so the results do not depend on which worker ran
+# what, and equal those of robot.run_simulation(..., seed=seed).
+#
+# The protocol is one JSON object per line in each direction. A worker sends
+# {"op": "get"} and receives {"task": {...}}, {"wait": seconds} or
+# {"done": true}; it returns a batch with {"op": "result", "id": ...,
+# "steps": [...]} and receives {"ok": true}.
+
+
+class Coordinator(object):
+    """
+    Hands out the trials of a sweep in batches and collects their results.
+    """
+    def __init__(self, points, num_trials, seed, batch_size=10, engine='python',
+                 lease_timeout=600.0):
+        """
+        points: a list of points, as returned by robot_sweep.make_point
+        num_trials: an int (num_trials > 0); trials per point
+        seed: an int (seed >= 0)
+        batch_size: an int (batch_size > 0); trials handed out at a time
+        engine: as for robot_sweep.run_sweep
+        lease_timeout: a float; seconds after which a batch that has not come
+                       back is given to another worker
+        """
+        self.points = points
+        # Workers run every point with the robot settings of this process.
+        self.settings = [robot_sweep.point_settings(point) for point in points]
+        self.num_trials = num_trials
+        self.seed = seed
+        self.engine = engine
+        self.lease_timeout = lease_timeout
+        self.tasks = []
+        for index in range(len(points)):
+            for first_trial in range(0, num_trials, batch_size):
+                self.tasks.append({'id': len(self.tasks), 'point': index,
+                                   'first_trial': first_trial,
+                                   'num_trials': min(batch_size, num_trials - first_trial)})
+        self.pending = collections.deque(range(len(self.tasks)))
+        # Task id -> (worker, time the lease runs out).
+        self.leases = {}
+        self.finished = set()
+        # Running total of time-steps per point.
+        self.totals = [0] * len(points)
+        self.lock = threading.Lock()
+        self.all_done = threading.Event()
+        if not self.tasks:
+            self.all_done.set()
+        self.server = None
+
+    def _reclaim(self, should_reclaim):
+        for task_id, lease in list(self.leases.items()):
+            if should_reclaim(lease):
+                del self.leases[task_id]
+                self.pending.appendleft(task_id)
+
+    def get_task(self, worker):
+        """
+        Returns: the reply to a worker's request for work
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._reclaim(lambda lease: lease[1] < now)
+            # A batch requeued when its lease ran out may have come back from
+            # its first worker since.
+            while self.pending and self.pending[0] in self.finished:
+                self.pending.popleft()
+            if self.pending:
+                task_id = self.pending.popleft()
+                self.leases[task_id] = (worker, now + self.lease_timeout)
+                task = dict(self.tasks[task_id])
+                task.update(point=self.points[task['point']], settings=self.settings[task['point']],
+                            seed=self.seed, engine=self.engine,
+                            generator=robot.generator_name())
+                return {'task': task}
+            if self.leases:
+                # Everything is handed out; wait in case a batch comes back.
+                return {'wait': 0.5}
+            return {'done': True}
+
+    def put_result(self, worker, task_id, steps):
+        """
+        Merges the time-steps of the trials of batch task_id. A batch that
+        was reassigned and has already come back is ignored.
+        """
+        with self.lock:
+            if task_id in self.finished:
+                return
+            self.leases.pop(task_id, None)
+            self.finished.add(task_id)
+            self.totals[self.tasks[task_id]['point']] += sum(steps)
+            if len(self.finished) == len(self.tasks):
+                self.all_done.set()
+
+    def release(self, worker):
+        """
+        Puts the batches leased to worker, whose connection has gone, back on
+        the queue.
+        """
+        with self.lock:
+            self._reclaim(lambda lease: lease[0] == worker)
+
+    def serve(self, host='127.0.0.1', port=0):
+        """
+        Starts serving workers in a background thread.
+
+        Returns: the (host, port) the coordinator listens on
+        """
+        self.server = _Server((host, port), _Handler)
+        self.server.coordinator = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address
+
+    def wait(self, timeout=None):
+        """
+        Waits until every trial has come back and stops serving.
+
+        Returns: a list with the mean number of time-steps at each point, or
+                 None if timeout seconds passed first
+        """
+        if not self.all_done.wait(timeout):
+            return None
+        # Let waiting workers hear that the sweep is done before closing.
+        time.sleep(1.0)
+        self.server.shutdown()
+        self.server.server_close()
+        return [total/self.num_trials for total in self.totals]
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Serves one worker's connection.
+    """
+    def handle(self):
+        coordinator = self.server.coordinator
+        worker = self.client_address
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if message['op'] == 'get':
+                    reply = coordinator.get_task(worker)
+                elif message['op'] == 'result':
+                    coordinator.put_result(worker, message['id'], message['steps'])
+                    reply = {'ok': True}
+                else:
+                    reply = {'error': 'unknown op: %r' % (message['op'],)}
+                self.wfile.write((json.dumps(reply) + '\n').encode())
+        except (OSError, ValueError):
+            pass
+        finally:
+            coordinator.release(worker)
+
+
+def run_batch(task):
+    """
+    Runs the trials of a batch handed out by a Coordinator, with the robot
+    settings of the coordinator.
+
+    Returns: the list of their time-steps
+
+    Raises ValueError if this process draws random numbers with another
+    generator than the coordinator (see robot.generator_name), as its results
+    would differ.
+    """
+    if task['generator'] != robot.generator_name():
+        raise ValueError('the coordinator draws random numbers with %s, this worker with %s'
+                         % (task['generator'], robot.generator_name()))
+    args = robot_sweep.point_args(task['point'])
+    robot.set_robot_settings(args[-1], task['settings'])
+    return [robot.run_trial(*args, engine=task['engine'],
+                            seed=robot.trial_seed(task['seed'], task['first_trial'] + i))
+            for i in range(task['num_trials'])]
+
+
+def run_worker(host, port):
+    """
+    Connects to the coordinator at (host, port) and runs batches until the
+    sweep is done or the coordinator goes away.
+
+    Returns: the number of batches run
+    """
+    num_batches = 0
+    with socket.create_connection((host, port)) as connection:
+        stream = connection.makefile('rw')
+
+        def call(message):
+            stream.write(json.dumps(message) + '\n')
+            stream.flush()
+            line = stream.readline()
+            if not line:
+                raise EOFError
+            return json.loads(line)
+
+        try:
+            while True:
+                reply = call({'op': 'get'})
+                if 'task' in reply:
+                    steps = run_batch(reply['task'])
+                    call({'op': 'result', 'id': reply['task']['id'], 'steps': steps})
+                    num_batches += 1
+                elif 'wait' in reply:
+                    time.sleep(reply['wait'])
+                else:
+                    return num_batches
+        except (OSError, EOFError):
+            return num_batches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a robot parameter sweep on worker processes.')
+    subparsers = parser.add_subparsers(dest='command')
+    coordinator_parser = subparsers.add_parser('coordinator', help='serve a sweep to workers')
+    coordinator_parser.add_argument('sweep', choices=sorted(robot_sweep.SWEEPS))
+    coordinator_parser.add_argument('--host', default='127.0.0.1')
+    coordinator_parser.add_argument('--port', type=int, default=6002)
+    coordinator_parser.add_argument('--trials', type=int, default=20)
+    coordinator_parser.add_argument('--seed', type=int, default=0)
+    coordinator_parser.add_argument('--batch-size', type=int, default=10)
+    coordinator_parser.add_argument('--engine', choices=['python', 'numpy'], default='python')
+    coordinator_parser.add_argument('--lease-timeout', type=float, default=600.0,
+                                    help='seconds before an unreturned batch is reassigned')
+    coordinator_parser.add_argument('--local-workers', type=int, default=0,
+                                    help='number of workers to start on this machine')
+    worker_parser = subparsers.add_parser('worker', help='run batches for a coordinator')
+    worker_parser.add_argument('--host', default='127.0.0.1')
+    worker_parser.add_argument('--port', type=int, default=6002)
+    args = parser.parse_args(argv)
+
+    if args.command == 'coordinator':
+        points = robot_sweep.SWEEPS[args.sweep]()
+        coordinator = Coordinator(points, args.trials, args.seed, args.batch_size, args.engine,
+                                  args.lease_timeout)
+        host, port = coordinator.serve(args.host, args.port)
+        print('serving %d batches on %s:%d' % (len(coordinator.tasks), host, port))
+        processes = []
+        if args.local_workers:
+            import multiprocessing
+            for i in range(args.local_workers):
+                process = multiprocessing.Process(target=run_worker, args=(host, port))
+                process.start()
+                processes.append(process)
+        means = coordinator.wait()
+        for process in processes:
+            process.join()
+        for point, mean in zip(points, means):
+            print('%-14s %2d robots  %2dx%-2d  avg time steps: %.1f'
+                  % (point['robot'], point['num_robots'], point['width'], point['height'], mean))
+    elif args.command == 'worker':
+        print('ran %d batches' % run_worker(args.host, args.port))
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import sys
+
+import robot
+
+# Parameter sweeps that survive interruption. Every finished trial is
+# appended to a journal file (one JSON object per line) as soon as it
+# completes; running the same sweep against the same journal again skips the
+# trials already there. Trial i of every point is seeded with
+# robot.trial_seed(seed, i), as run_simulation does, so a resumed sweep gives
+# exactly the results of an uninterrupted one.
+
+# The run_simulation parameters that make up a point of a sweep, in order.
+POINT_KEYS = ('robot', 'num_robots', 'speed', 'capacity', 'width', 'height', 'dirt_amount',
+              'min_coverage')
+
+
+def make_point(robot_type, num_robots, speed, capacity, width, height, dirt_amount, min_coverage):
+    """
+    Returns: a point of a sweep, as a dictionary with keys POINT_KEYS;
+             robot_type is given by its name
+    """
+    return dict(zip(POINT_KEYS, (robot_type.__name__, num_robots, speed, capacity, width, height,
+                                 dirt_amount, min_coverage)))
+
+
+def strategies_points():
+    """
+    Returns: the points of robot.show_plot_compare_strategies
+    """
+    return [make_point(robot_type, num_robots, 1.0, 1, 20, 20, 3, 0.8)
+            for num_robots in range(1, 11)
+            for robot_type in (robot.StandardRobot, robot.CheapRobot, robot.SuperbRobot)]
+
+
+def room_shape_points():
+    """
+    Returns: the points of robot.show_plot_room_shape
+    """
+    return [make_point(robot_type, 2, 1.0, 1, width, int(300/width), 3, 0.8)
+            for width in [10, 20, 25, 50]
+            for robot_type in (robot.StandardRobot, robot.CheapRobot, robot.SuperbRobot)]
+
+
+SWEEPS = {'strategies': strategies_points, 'room-shape': room_shape_points}
+
+
+def point_settings(point):
+    """
+    Returns: the current settings of the robot type of point, as returned by
+             robot.get_robot_settings
+    """
+    return robot.get_robot_settings(robot.ROBOT_TYPES[point['robot']])
+
+
+def _journal_key(point, settings, seed, engine, generator):
+    # Everything that determines a trial's result besides the simulation
+    # version, which read_journal checks.
+    return json.dumps([point, settings, seed, engine, generator], sort_keys=True)
+
+
+def read_journal(path):
+    """
+    Reads the journal at path, if it exists.
+
+    Returns: a dictionary mapping (journal key, trial) to the trial's
+             time-steps
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by an interruption; its trial is rerun.
+                continue
+            key = _journal_key(entry['point'], entry.get('settings'), entry['seed'],
+                               entry['engine'], entry.get('generator'))
+            if entry['version'] == robot.SIMULATION_VERSION:
+                done[(key, entry['trial'])] = entry['steps']
+    return done
+
+
+class Journal(object):
+    """
+    An append-only journal of finished trials.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.done = read_journal(path)
+        self.file = open(path, 'a')
+        if self.file.tell() and not self._ends_with_newline():
+            # Finish a line cut short by an interruption, so that the next
+            # entry starts on a line of its own.
+            self.file.write('\n')
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def get(self, point, seed, engine, trial):
+        """
+        Returns: the journaled time-steps of trial of point, run with the
+                 current settings of its robot type and the current random
+                 number generator, or None
+        """
+        return self.done.get((_journal_key(point, point_settings(point), seed, engine,
+                                           robot.generator_name()), trial))
+
+    def append(self, point, seed, engine, trial, steps):
+        """
+        Journals the result of trial of point, flushing it to the file at once.
+        """
+        settings = point_settings(point)
+        generator = robot.generator_name()
+        self.done[(_journal_key(point, settings, seed, engine, generator), trial)] = steps
+        self.file.write(json.dumps({'point': point, 'settings': settings, 'seed': seed,
+                                    'engine': engine, 'generator': generator,
+                                    'version': robot.SIMULATION_VERSION, 'trial': trial,
+                                    'steps': steps}, sort_keys=True) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def point_args(point):
+    """
+    Returns: the positional arguments of robot.run_trial, up to robot_type,
+             for point
+    """
+    return (point['num_robots'], point['speed'], point['capacity'], point['width'],
+            point['height'], point['dirt_amount'], point['min_coverage'],
+            robot.ROBOT_TYPES[point['robot']])
+
+
+def _run_trial(point, settings, engine, seed):
+    # The unit of work for process pools, which do not inherit the robot
+    # settings of the parent under the spawn and forkserver start methods.
+    args = point_args(point)
+    robot.set_robot_settings(args[-1], settings)
+    return robot.run_trial(*args, engine=engine, seed=seed)
+
+
+def run_sweep(points, num_trials, seed, journal_path, engine='python', workers=None):
+    """
+    Runs num_trials trials at each point of a sweep, skipping the trials
+    already in the journal at journal_path and journaling the rest as they
+    finish.
+
+    points: a list of points, as returned by make_point
+    num_trials: an int (num_trials > 0)
+    seed: an int (seed >= 0)
+    journal_path: a string; the journal file, created if needed
+    engine: as for robot.run_simulation, except 'batched', which does not
+            seed trials one by one
+    workers: an int or None; if greater than 1, trials are spread over a pool
+             of that many processes
+
+    Returns: a list with the mean number of time-steps at each point, equal to
+             robot.run_simulation(..., seed=seed) at that point
+    """
+    if engine == 'batched':
+        raise ValueError("engine 'batched' cannot be resumed trial by trial")
+    journal = Journal(journal_path)
+    try:
+        todo = [(point, trial) for point in points for trial in range(num_trials)
+                if journal.get(point, seed, engine, trial) is None]
+        if workers is None or workers <= 1:
+            for point, trial in todo:
+                steps = robot.run_trial(*point_args(point), engine=engine,
+                                        seed=robot.trial_seed(seed, trial))
+                journal.append(point, seed, engine, trial, steps)
+        else:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_run_trial, point, point_settings(point), engine,
+                                       robot.trial_seed(seed, trial)): (point, trial)
+                           for point, trial in todo}
+                for future in as_completed(futures):
+                    point, trial = futures[future]
+                    journal.append(point, seed, engine, trial, future.result())
+        return [sum(journal.get(point, seed, engine, trial) for trial in range(num_trials))/num_trials
+                for point in points]
+    finally:
+        journal.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a robot parameter sweep that can be '
+                                                 'interrupted and resumed.')
+    parser.add_argument('sweep', choices=sorted(SWEEPS))
+    parser.add_argument('journal', help='journal file; rerun with the same file to resume')
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args(argv)
+
+    points = SWEEPS[args.sweep]()
+    means = run_sweep(points, args.trials, args.seed, args.journal, args.engine, args.workers)
+    for point, mean in zip(points, means):
+        print('%-14s %2d robots  %2dx%-2d  avg time steps: %.1f'
+              % (point['robot'], point['num_robots'], point['width'], point['height'], mean))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+import argparse
+import math
+import mmap
+import struct
+import sys
+from array import array
+
+import robot
+
+# Recording of robot trajectories to a compact binary file, and offline replay.
+#
+# A recording is a header, one record per tick and an index of where each
+# record starts:
+#
+#   header   magic 'RTRJ', version, num_robots, width, height, dirt_amount
+#   record   tick, number of tile changes, the x, y and direction (float64) of
+#            every robot after the tick, then (m, n, dirt delta) as int32 for
+#            every change to a tile's dirt during the tick
+#   index    the file offset of every record (uint64)
+#   trailer  offset of the index, number of records, magic 'RTRX'
+#
+# Record 0 holds the robots' starting positions. Numbers are stored in the
+# recording machine's byte order. The index lets a reader memory-map the file
+# and jump straight to any tick.
+
+MAGIC = b'RTRJ'
+TRAILER_MAGIC = b'RTRX'
+VERSION = 1
+HEADER = struct.Struct('=4sIIIIq')
+TICK = struct.Struct('=II')
+TRAILER = struct.Struct('=QQ4s')
+
+
+class TrajectoryRecorder(object):
+    """
+    Writes a recording tick by tick. Records are gathered in a buffer of at
+    most about buffer_size bytes, which is written out whenever it fills, so
+    recording costs one memory copy per tick and memory use stays bounded
+    however long the run.
+    """
+    def __init__(self, path, num_robots, width, height, dirt_amount, buffer_size=1 << 20):
+        """
+        Creates (or overwrites) the recording at path.
+
+        path: a string
+        num_robots, width, height, dirt_amount: as for robot.run_simulation
+        buffer_size: an int (buffer_size > 0); bytes to gather before writing
+        """
+        self.num_robots = num_robots
+        self.buffer_size = buffer_size
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, num_robots, width, height, dirt_amount))
+        self.position = HEADER.size
+        self.buffer = bytearray()
+        self.offsets = array('Q')
+        # (m, n, delta) of the tile changes made during the current tick.
+        self.changes = array('i')
+
+    def record_change(self, m, n, delta):
+        """
+        Notes that the dirt on tile (m, n) changed by delta during this tick.
+        """
+        self.changes.extend((m, n, delta))
+
+    def record_tick(self, fleet):
+        """
+        Ends the current tick, recording the state of fleet (a robot.RobotFleet)
+        and the tile changes noted since the last tick.
+        """
+        changes = self.changes
+        record = (TICK.pack(len(self.offsets), len(changes) // 3) + fleet.xs.tobytes() +
+                  fleet.ys.tobytes() + fleet.directions.tobytes() + changes.tobytes())
+        self.offsets.append(self.position)
+        self.position += len(record)
+        self.buffer += record
+        del changes[:]
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes out the buffered records.
+        """
+        self.file.write(self.buffer)
+        del self.buffer[:]
+
+    def close(self):
+        """
+        Writes out the buffered records and the index, and closes the file.
+        """
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.write(self.offsets.tobytes())
+        self.file.write(TRAILER.pack(self.position, len(self.offsets), TRAILER_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _RecordingRoom(object):
+    """
+    Wraps a room so that every change to a tile's dirt made through it is
+    noted by a TrajectoryRecorder. Everything else is passed through to the
+    room.
+    """
+    def __init__(self, room, recorder):
+        self.room = room
+        self.recorder = recorder
+        # Bound directly so that the bounds check pays nothing for the wrapper.
+        self.can_move = room.can_move
+
+    def __getattr__(self, name):
+        return getattr(self.room, name)
+
+    def clean_tile_at_xy(self, x, y, capacity):
+        m = int(x)
+        n = int(y)
+        before = self.room.get_dirt_amount(m, n)
+        self.room.clean_tile_at_xy(x, y, capacity)
+        delta = self.room.get_dirt_amount(m, n) - before
+        if delta:
+            self.recorder.record_change(m, n, delta)
+
+
+def record_trial(path, num_robots, speed, capacity, width, height, dirt_amount, min_coverage,
+                 robot_type, seed=None, room_type=robot.SimpleRoom, buffer_size=1 << 20):
+    """
+    Runs a single trial like robot.run_trial (engine 'python'), recording it
+    to path.
+
+    buffer_size: as for TrajectoryRecorder
+    Other arguments are as for robot.run_trial.
+
+    Returns: the number of time-steps needed to clean the fraction
+             min_coverage of the room
+    """
+    if seed is not None:
+        robot.seed_random(seed)
+    room = room_type(width, height, dirt_amount)
+    fleet = robot.RobotFleet(room, robot_type, num_robots, speed, capacity)
+    num_tiles = room.get_num_tiles()
+    with TrajectoryRecorder(path, num_robots, width, height, dirt_amount, buffer_size) as recorder:
+        fleet.cursor.room = _RecordingRoom(room, recorder)
+        recorder.record_tick(fleet)
+        steps = 0
+        # As in robot.run_trial_coverages, coverage counts as 0 before the
+        # first tick and is measured after each tick.
+        coverage = 0
+        while coverage < min_coverage:
+            steps += 1
+            fleet.update_position_and_clean()
+            recorder.record_tick(fleet)
+            coverage = room.get_num_cleaned_tiles()/num_tiles
+    return steps
+
+
+class Trajectory(object):
+    """
+    A recording opened for reading. The file is memory-mapped, so only the
+    ticks that are looked at are read from disk.
+    """
+    def __init__(self, path):
+        """
+        Opens the recording at path.
+        """
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_robots, self.width, self.height, self.dirt_amount = \
+            HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a trajectory recording this version can read' % path)
+        index_offset, num_ticks, magic = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        if magic != TRAILER_MAGIC:
+            raise ValueError('%s is incomplete; was the recording closed?' % path)
+        self.offsets = array('Q', self.data[index_offset:index_offset + 8 * num_ticks])
+        # The tick that dirt, below, describes; moved forward incrementally.
+        self.dirt_tick = -1
+        self.dirt = {}
+
+    def __len__(self):
+        """
+        Returns: the number of ticks recorded, counting the starting state
+        """
+        return len(self.offsets)
+
+    def _read(self, tick):
+        offset = self.offsets[tick]
+        _, num_changes = TICK.unpack_from(self.data, offset)
+        offset += TICK.size
+        size = 8 * self.num_robots
+        states = [array('d', self.data[offset + i * size:offset + (i + 1) * size]) for i in range(3)]
+        offset += 3 * size
+        changes = array('i', self.data[offset:offset + 12 * num_changes])
+        return states, changes
+
+    def robots(self, tick):
+        """
+        Returns: (xs, ys, directions), arrays of the robots' positions and
+                 directions after tick
+        """
+        return tuple(self._read(tick)[0])
+
+    def changes(self, tick):
+        """
+        Returns: a list of the (m, n, delta) changes made to the dirt of tiles
+                 during tick
+        """
+        changes = self._read(tick)[1]
+        return [tuple(changes[i:i + 3]) for i in range(0, len(changes), 3)]
+
+    def dirt_at(self, tick):
+        """
+        Returns: a dictionary mapping every tile whose dirt differs from
+                 dirt_amount after tick to its dirt. Do not modify it.
+
+        Seeking forward only applies the ticks in between; seeking backward
+        starts again from the beginning.
+        """
+        if tick < self.dirt_tick:
+            self.dirt_tick = -1
+            self.dirt = {}
+        dirt = self.dirt
+        for t in range(self.dirt_tick + 1, tick + 1):
+            changes = self._read(t)[1]
+            for i in range(0, len(changes), 3):
+                tile = (changes[i], changes[i + 1])
+                dirt[tile] = dirt.get(tile, self.dirt_amount) + changes[i + 2]
+        self.dirt_tick = tick
+        return dirt
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def animate(trajectory, start=0, stop=None, interval=50):
+    """
+    Plays back ticks start to stop (exclusive; None for the end) of a
+    Trajectory, showing each tile's dirt and the robots' positions and
+    directions.
+
+    interval: an int; milliseconds between frames
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+    if stop is None:
+        stop = len(trajectory)
+    grid = [[trajectory.dirt_amount] * trajectory.width for n in range(trajectory.height)]
+    for (m, n), dirt in trajectory.dirt_at(start).items():
+        grid[n][m] = dirt
+    figure, axes = plt.subplots()
+    image = axes.imshow(grid, origin='lower', cmap='Greys', vmin=0,
+                        vmax=max(1, trajectory.dirt_amount),
+                        extent=(0, trajectory.width, 0, trajectory.height))
+    xs, ys, directions = trajectory.robots(start)
+    arrows = axes.quiver(xs, ys, [0.0] * len(xs), [0.0] * len(xs), color='red')
+    title = axes.set_title('')
+
+    def draw(tick):
+        if tick > start:
+            for m, n, delta in trajectory.changes(tick):
+                grid[n][m] += delta
+        image.set_data(grid)
+        xs, ys, directions = trajectory.robots(tick)
+        # Same convention as robot.Position: 0 degrees points along +y.
+        arrows.set_offsets(list(zip(xs, ys)))
+        arrows.set_UVC([math.sin(math.radians(d)) for d in directions],
+                       [math.cos(math.radians(d)) for d in directions])
+        title.set_text('tick %d' % tick)
+        return image, arrows, title
+
+    animation = FuncAnimation(figure, draw, frames=range(start, stop), interval=interval,
+                              repeat=False)
+    plt.show()
+    return animation
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record and replay robot trajectories.')
+    subparsers = parser.add_subparsers(dest='command')
+    record_parser = subparsers.add_parser('record', help='record one trial')
+    record_parser.add_argument('output', help='file to record to')
+    record_parser.add_argument('--robot', choices=sorted(robot.ROBOT_TYPES), default='StandardRobot')
+    record_parser.add_argument('--robots', type=int, default=1, help='number of robots')
+    record_parser.add_argument('--speed', type=float, default=1.0)
+    record_parser.add_argument('--capacity', type=int, default=1)
+    record_parser.add_argument('--width', type=int, default=10)
+    record_parser.add_argument('--height', type=int, default=10)
+    record_parser.add_argument('--dirt', type=int, default=3, help='dirt on each tile')
+    record_parser.add_argument('--coverage', type=float, default=0.8)
+    record_parser.add_argument('--seed', type=int)
+    record_parser.add_argument('--room', choices=sorted(robot.ROOM_TYPES), default='simple')
+    info_parser = subparsers.add_parser('info', help='summarize a recording')
+    info_parser.add_argument('recording')
+    replay_parser = subparsers.add_parser('replay', help='animate a recording')
+    replay_parser.add_argument('recording')
+    replay_parser.add_argument('--start', type=int, default=0, help='first tick to show')
+    replay_parser.add_argument('--stop', type=int, help='tick to stop before')
+    replay_parser.add_argument('--interval', type=int, default=50, help='milliseconds per frame')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        steps = record_trial(args.output, args.robots, args.speed, args.capacity, args.width,
+                             args.height, args.dirt, args.coverage, robot.ROBOT_TYPES[args.robot],
+                             args.seed, robot.ROOM_TYPES[args.room])
+        print('recorded %d time-steps to %s' % (steps, args.output))
+    elif args.command == 'info':
+        with Trajectory(args.recording) as trajectory:
+            print('%d robots in a %dx%d room with dirt %d, %d ticks'
+                  % (trajectory.num_robots, trajectory.width, trajectory.height,
+                     trajectory.dirt_amount, len(trajectory) - 1))
+    elif args.command == 'replay':
+        with Trajectory(args.recording) as trajectory:
+            animate(trajectory, args.start, args.stop, args.interval)
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+import numpy as np
+
+# Array-backed versions of SimpleRoom and the robot classes in robot.py.
+# The room keeps its dirt in a 2-D array and every robot's state lives in
+# parallel arrays, so one clock-tick of the whole fleet is a handful of
+# NumPy operations instead of a Python loop over Robot objects. BatchedRoom
+# goes one step further and stacks the rooms of many trials into one array so
+# that all trials advance together.
+
+STANDARD = 'standard'
+CHEAP = 'cheap'
+SUPERB = 'superb'
+KINDS = (STANDARD, CHEAP, SUPERB)
+
+
+class VectorizedRoom(object):
+    """
+    A VectorizedRoom is a SimpleRoom whose dirt is stored in a (width, height)
+    integer array indexed by tile coordinates.
+
+    Like SimpleRoom, it keeps a running count of clean tiles, updated from the
+    tiles each clean_tiles call touches, so coverage is O(1) per tick.
+    """
+    def __init__(self, width, height, dirt_amount):
+        """
+        Initializes a rectangular room with the specified width, height, and
+        dirt_amount on each tile.
+
+        width: an integer > 0
+        height: an integer > 0
+        dirt_amount: an integer >= 0
+        """
+        self.width = width
+        self.height = height
+        self.dirt_amount = dirt_amount
+        self.dirt = np.full((width, height), dirt_amount, dtype=np.int64)
+        self.num_cleaned_tiles = width * height if dirt_amount == 0 else 0
+
+    def robot_shape(self, num_robots):
+        """
+        Returns: the shape of the state arrays of num_robots robots in this room
+        """
+        return (num_robots,)
+
+    def _flat_tiles(self, mask, xs, ys):
+        """
+        Returns: the indices into the flattened dirt array of the tiles under
+                 the positions selected by mask
+        """
+        return xs[mask].astype(np.intp) * self.height + ys[mask].astype(np.intp)
+
+    def clean_tiles(self, mask, xs, ys, capacity):
+        """
+        Cleans the tiles under the positions (xs[i], ys[i]) selected by mask by
+        capacity amount of dirt each, clamping the dirt on every tile at 0.
+
+        mask: a boolean array selecting the robots that clean
+        xs, ys: float arrays of robot positions inside the room
+        capacity: an int, or an int array shaped like xs; negative values add dirt
+        """
+        if not mask.any():
+            return
+        tiles = self._flat_tiles(mask, xs, ys)
+        if np.ndim(capacity):
+            capacity = capacity[mask]
+        dirt = self.dirt.reshape(-1)
+        before = dirt[tiles]
+        # subtract.at accumulates over robots sharing a tile in the same tick.
+        np.subtract.at(dirt, tiles, capacity)
+        after = np.maximum(dirt[tiles], 0)
+        dirt[tiles] = after
+        self._count_cleaned(tiles, before, after)
+
+    def _count_cleaned(self, tiles, before, after):
+        """
+        Updates the running count of clean tiles from the dirt before and
+        after a clean_tiles call on each of tiles, which may repeat.
+        """
+        # A call touches at most one tile per robot, few enough that plain
+        # Python beats further array operations.
+        changes = {}
+        for tile, old, new in zip(tiles.tolist(), before.tolist(), after.tolist()):
+            if (old == 0) != (new == 0):
+                changes[tile] = 1 if new == 0 else -1
+        if changes:
+            self.num_cleaned_tiles += sum(changes.values())
+
+    def in_room(self, xs, ys):
+        """
+        Returns: a boolean array; True where (xs[i], ys[i]) is inside the room
+        """
+        return (0 <= xs) & (xs < self.width) & (0 <= ys) & (ys < self.height)
+
+    def get_num_cleaned_tiles(self):
+        """
+        Returns: an integer; the total number of clean tiles in the room
+        """
+        return self.num_cleaned_tiles
+
+    def get_num_tiles(self):
+        """
+        Returns: an integer; the total number of tiles in the room
+        """
+        return self.width * self.height
+
+
+class BatchedRoom(VectorizedRoom):
+    """
+    A BatchedRoom holds the rooms of num_trials independent trials in a single
+    (num_trials, width, height) dirt array. Robot state arrays in a BatchedRoom
+    have shape (num_trials, num_robots).
+    """
+    def __init__(self, num_trials, width, height, dirt_amount):
+        """
+        Initializes num_trials rectangular rooms with the specified width,
+        height, and dirt_amount on each tile.
+
+        num_trials: an integer > 0
+        width: an integer > 0
+        height: an integer > 0
+        dirt_amount: an integer >= 0
+        """
+        self.num_trials = num_trials
+        self.width = width
+        self.height = height
+        self.dirt_amount = dirt_amount
+        self.dirt = np.full((num_trials, width, height), dirt_amount, dtype=np.int64)
+        # Running count of clean tiles in each trial's room.
+        self.num_cleaned_tiles = np.full(num_trials, width * height if dirt_amount == 0 else 0,
+                                         dtype=np.int64)
+        # Scratch space for _count_cleaned, one entry per tile.
+        self.claims = np.empty(num_trials * width * height, dtype=np.int32)
+
+    def robot_shape(self, num_robots):
+        """
+        Returns: the shape of the state arrays of num_robots robots per trial
+        """
+        return (self.num_trials, num_robots)
+
+    def _flat_tiles(self, mask, xs, ys):
+        trials = np.nonzero(mask)[0]
+        return ((trials * self.width + xs[mask].astype(np.intp)) * self.height
+                + ys[mask].astype(np.intp))
+
+    def _count_cleaned(self, tiles, before, after):
+        # +1 where a tile became clean, -1 where it was dirtied again.
+        change = (after == 0).view(np.int8) - (before == 0).view(np.int8)
+        changed = np.flatnonzero(change)
+        if not changed.size:
+            return
+        tiles = tiles[changed]
+        # Robots sharing a tile each see its change. Every robot writes its
+        # number to the tile in claims; only the one whose number stuck
+        # counts the change.
+        numbers = np.arange(changed.size, dtype=np.int32)
+        self.claims[tiles] = numbers
+        counted = self.claims[tiles] == numbers
+        # add.at accumulates over the tiles of each trial.
+        np.add.at(self.num_cleaned_tiles, tiles[counted] // (self.width * self.height),
+                  change[changed][counted])
+
+    def get_num_cleaned_tiles(self):
+        """
+        Returns: an integer array; the number of clean tiles in each trial's room
+        """
+        return self.num_cleaned_tiles.copy()
+
+
+class VectorizedRobots(object):
+    """
+    A fleet of robots of one kind ('standard', 'cheap' or 'superb') stored as
+    parallel arrays of x, y, direction, speed and capacity. In a BatchedRoom
+    the arrays hold one row of robots per trial.
+
+    Each kind follows the same movement rules as StandardRobot, CheapRobot and
+    SuperbRobot respectively.
+    """
+    def __init__(self, room, num_robots, speed, capacity, kind, rng,
+                 drop_probability=0.0, dirty_amount=1):
+        """
+        Places num_robots robots at random positions and directions in room.
+
+        room: a VectorizedRoom or BatchedRoom
+        num_robots: an int (num_robots > 0); per trial in a BatchedRoom
+        speed: a float (speed > 0)
+        capacity: a positive integer
+        kind: one of 'standard', 'cheap' or 'superb'
+        rng: a numpy.random.Generator
+        drop_probability: for 'cheap', the probability of dropping dirt each
+                          step; for 'superb', the probability of dirtying the
+                          tile after hitting a wall
+        dirty_amount: for 'cheap', the amount of dirt dropped
+        """
+        if kind not in KINDS:
+            raise ValueError('unknown robot kind: %r' % (kind,))
+        self.room = room
+        self.kind = kind
+        self.rng = rng
+        self.drop_probability = drop_probability
+        self.dirty_amount = dirty_amount
+        shape = room.robot_shape(num_robots)
+        self.x = rng.uniform(0, room.width, shape)
+        self.y = rng.uniform(0, room.height, shape)
+        self.direction = rng.uniform(0, 360, shape)
+        self.speed = np.full(shape, float(speed))
+        self.capacity = np.full(shape, capacity, dtype=np.int64)
+        self.dx = np.empty(shape)
+        self.dy = np.empty(shape)
+        self._update_direction_vectors(np.ones(shape, dtype=bool))
+
+    def _update_direction_vectors(self, mask):
+        # Same convention as Position.get_new_position: 0 degrees points along +y.
+        radians = np.radians(self.direction[mask])
+        self.dx[mask] = self.speed[mask] * np.sin(radians)
+        self.dy[mask] = self.speed[mask] * np.cos(radians)
+
+    def _turn(self, mask):
+        """
+        Points the robots selected by mask in new random directions.
+        """
+        count = np.count_nonzero(mask)
+        if count:
+            self.direction[mask] = self.rng.uniform(0, 360, count)
+            self._update_direction_vectors(mask)
+
+    def _advance(self, mask):
+        """
+        Moves the robots selected by mask one step forward if the new position
+        is in the room, and cleans the tile they arrive on.
+
+        Returns: a boolean array of the robots that moved.
+        """
+        new_x = self.x + self.dx
+        new_y = self.y + self.dy
+        moved = mask & self.room.in_room(new_x, new_y)
+        self.x[moved] = new_x[moved]
+        self.y[moved] = new_y[moved]
+        self.room.clean_tiles(moved, self.x, self.y, self.capacity)
+        return moved
+
+    def update_position_and_clean(self, active=None):
+        """
+        Simulates the passage of a single time-step for every robot.
+
+        active: a boolean array broadcastable to the robot state arrays, or
+                None; robots where it is False do not move, clean or draw
+                random numbers
+        """
+        shape = self.x.shape
+        moving = np.ones(shape, dtype=bool)
+        if active is not None:
+            moving &= active
+        turning = np.zeros(shape, dtype=bool)
+        if self.kind == CHEAP:
+            drops = moving & (self.rng.random(shape) < self.drop_probability)
+            self.room.clean_tiles(drops, self.x, self.y, -self.dirty_amount)
+            moving &= ~drops
+            turning |= drops
+        moved = self._advance(moving)
+        turning |= moving & ~moved
+        if self.kind == SUPERB:
+            stopped = moved & ~self._advance(moved)
+            dirties = stopped & (self.rng.random(shape) < self.drop_probability)
+            self.room.clean_tiles(dirties, self.x, self.y, -1)
+            turning |= stopped
+        self._turn(turning)
+
+
+def run_vectorized_trial(num_robots, speed, capacity, width, height, dirt_amount,
+                         coverages, kind, rng=None, drop_probability=0.0, dirty_amount=1):
+    """
+    Runs a single trial of the simulation with the array-backed engine until
+    every fraction in coverages of the room is clean.
+
+    Arguments are as for robot.run_trial_coverages, except that the robot type
+    is given by kind and its parameters (see VectorizedRobots). rng is a
+    numpy.random.Generator, or a seed for a new one.
+
+    Returns: a list; for each entry of coverages, the first time-step at which
+             that fraction of the room was clean
+    """
+    rng = np.random.default_rng(rng)
+    room = VectorizedRoom(width, height, dirt_amount)
+    robots = VectorizedRobots(room, num_robots, speed, capacity, kind, rng,
+                              drop_probability, dirty_amount)
+    num_tiles = room.get_num_tiles()
+    order = sorted(range(len(coverages)), key=coverages.__getitem__)
+    crossed_at = [0] * len(coverages)
+    steps = 0
+    coverage = 0
+    k = 0
+    while True:
+        while k < len(order) and coverage >= coverages[order[k]]:
+            crossed_at[order[k]] = steps
+            k += 1
+        if k == len(order):
+            return crossed_at
+        steps += 1
+        robots.update_position_and_clean()
+        coverage = room.get_num_cleaned_tiles() / num_tiles
+
+
+def run_batched_trials(num_robots, speed, capacity, width, height, dirt_amount,
+                       coverages, num_trials, kind, rng=None, drop_probability=0.0,
+                       dirty_amount=1):
+    """
+    Runs num_trials trials of the simulation side by side in one BatchedRoom.
+
+    Every trial advances together each tick and records the first step at
+    which each fraction in coverages of its room is clean; a trial that has
+    crossed every threshold is masked out. Arguments are as for
+    run_vectorized_trial.
+
+    Returns: an int array of shape (num_trials, len(coverages)); the number of
+             time-steps each trial needed to reach each coverage
+    """
+    rng = np.random.default_rng(rng)
+    room = BatchedRoom(num_trials, width, height, dirt_amount)
+    robots = VectorizedRobots(room, num_robots, speed, capacity, kind, rng,
+                              drop_probability, dirty_amount)
+    num_tiles = room.get_num_tiles()
+    levels = np.asarray(coverages, dtype=float)
+    crossed_at = np.zeros((num_trials, len(levels)), dtype=np.int64)
+    pending = np.ones((num_trials, len(levels)), dtype=bool)
+    coverage = np.zeros(num_trials)
+    steps = 0
+    while True:
+        crossed = pending & (coverage[:, np.newaxis] >= levels)
+        crossed_at[crossed] = steps
+        pending &= ~crossed
+        active = pending.any(axis=1)
+        if not active.any():
+            return crossed_at
+        steps += 1
+        robots.update_position_and_clean(active[:, np.newaxis])
+        coverage = room.get_num_cleaned_tiles() / num_tiles
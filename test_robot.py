@@ -0,0 +1,39 @@
+import robot
+
+
+class PositionSettingRobot(robot.StandardRobot):
+    """
+    A StandardRobot that moves the way the original robots did, by replacing
+    its Position with set_robot_position rather than updating it in place.
+    """
+    def update_position_and_clean(self):
+        new_position = self.position.get_new_position(self.direction, self.speed)
+        if self.room.is_position_in_room(new_position):
+            self.set_robot_position(new_position)
+            self.room.clean_tile_at_position(new_position, self.capacity)
+        else:
+            self.set_robot_direction(robot.rng.uniform(0,360))
+
+
+def fleet_path(robot_type, num_robots, num_ticks, seed):
+    robot.seed_random(seed)
+    fleet = robot.RobotFleet(robot.SimpleRoom(10, 10, 3), robot_type, num_robots, 1.0, 1)
+    path = []
+    for tick in range(num_ticks):
+        fleet.update_position_and_clean()
+        path.append(list(zip(fleet.xs, fleet.ys)))
+    return path
+
+
+def test_fleet_steps_robots_that_set_their_position():
+    # Both kinds of robot draw the same random numbers, so from the same seed
+    # they must follow the same paths.
+    expected = fleet_path(robot.StandardRobot, 3, 200, seed=0)
+    path = fleet_path(PositionSettingRobot, 3, 200, seed=0)
+    assert path == expected
+    assert len(set(path[-1])) == 3
+
+
+def test_run_simulation_with_robots_that_set_their_position():
+    assert (robot.run_simulation(1, 1.0, 1, 5, 5, 3, 1.0, 5, PositionSettingRobot, seed=1) ==
+            robot.run_simulation(1, 1.0, 1, 5, 5, 3, 1.0, 5, robot.StandardRobot, seed=1))
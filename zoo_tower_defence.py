@@ -33,6 +33,9 @@ class Constants:
 
     TRAINEE_THRESHOLD = 3
 
+    # side of the square cells that blockers are bucketed into for formation_placeable
+    GRID_CELL_SIZE = 64
+
     TEXTURES = {
         'rock': '1f5ff',
         'animal': '1f418',
@@ -147,6 +150,10 @@ class Game:
         self.animal_speed = game_info['animal_speed']
         self.num_allowed_unfed = game_info['num_allowed_unfed']
         self.pathcoordlist = othergenpath(self.path_corners)
+        # Combined speed multiplier of all the demons and VHS cassettes in range of each
+        # path coordinate, updated whenever one is placed (see add_slowdown)
+        self.path_speed_multipliers = [1] * len(self.pathcoordlist)
+        self.num_slowdowns = 0
         self.animal_texture = Constants.TEXTURES['animal']
         self.animal_size = (Constants.ANIMAL_WIDTH, Constants.ANIMAL_HEIGHT)
         # Initialize each type of formation as a set
@@ -187,6 +194,18 @@ class Game:
             rock_texture = Constants.TEXTURES['rock']
             rock_size = (Constants.ROCK_WIDTH, Constants.ROCK_HEIGHT)
             self.rock_set.add(Formation(rock_loc, rock_texture, rock_size))
+        # Bucket the rocks and path rectangles, which never move, into a grid so that
+        # formation_placeable only checks the ones near a location
+        self.blocker_grid = {}
+        for rock in self.rock_set:
+            add_to_grid(self.blocker_grid, (rock.loc, rock.size[0], rock.size[1]))
+        for path_rectangle in self.pathcorner_objects:
+            add_to_grid(self.blocker_grid, path_rectangle)
+        # Same for the centres of the demons, VHS cassettes and zookeepers placed so far
+        self.placed_grid = {}
+        self.num_placed = 0
+        # Placeability bitmaps by footprint (see placeability_bitmap), cleared whenever a formation is placed
+        self.placeability_cache = {}
         # Initialize game-clock as 0 and increase it by 1 at every timestep
         self.gameclock = 0
         self.status = "ongoing"
@@ -280,45 +299,138 @@ class Game:
                 return True
         return False
      
+    def add_slowdown(self, formation):
+        """
+        This function will fold the speed multiplier of a placed demon or VHS cassette
+        into the multiplier of every path coordinate within its range.
+        """
+        for i in range(len(self.pathcoordlist)):
+            if distance(self.pathcoordlist[i], formation.loc) <= formation.range_radius:
+                self.path_speed_multipliers[i] *= formation.speed_multiplier
+        self.num_slowdowns += 1
+
+    def rebuild_slowdowns(self):
+        """
+        This function will recompute the path speed multipliers from scratch, for when
+        demons or VHS cassettes were added to the game other than by placing them.
+        """
+        self.path_speed_multipliers = [1] * len(self.pathcoordlist)
+        self.num_slowdowns = 0
+        for formation in list(self.demon_set) + list(self.VHS_set):
+            self.add_slowdown(formation)
+
+    def animal_in_sight(self, zookeeper, animal_indices):
+        """
+        This function will check if any animal is in the zookeeper's line of sight, given
+        the sorted list of the path indices the animals are at.
+        """
+        runs = zookeeper.visible_runs
+        if runs is None or any(i in zookeeper.unsure_indices for i in animal_indices):
+            # No cached line of sight to go by, so check every animal
+            for animal in self.animal_set:
+                if los_intersects(animal.loc, animal.size[0], zookeeper.loc, zookeeper.aim_dir):
+                    return True
+            return False
+        for start, end in runs:
+            # Binary search for the first animal at or after the start of the run
+            low, high = 0, len(animal_indices)
+            while low < high:
+                middle = (low + high) // 2
+                if animal_indices[middle] < start:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low < len(animal_indices) and animal_indices[low] <= end:
+                return True
+        return False
+
+    def add_placed(self, formation):
+        """
+        This function will add a placed demon, VHS cassette or zookeeper to the grid of
+        placed formations.
+        """
+        cell = grid_cells(formation.loc, formation.loc)[0]
+        if cell in self.placed_grid:
+            self.placed_grid[cell].append(formation.loc)
+        else:
+            self.placed_grid[cell] = [formation.loc]
+        self.num_placed += 1
+        self.placeability_cache = {}
+
+    def rebuild_placed(self):
+        """
+        This function will rebuild the grid of placed formations from scratch, for when
+        formations were added to the game other than by placing them.
+        """
+        self.placed_grid = {}
+        self.num_placed = 0
+        for formation in list(self.demon_set) + list(self.VHS_set) + list(self.zookeeper_set):
+            self.add_placed(formation)
+
     def formation_placeable(self, formation, location, width, height):
         """
         This function will check if the selected zookeeper can be placed at the given location.
         """
-        overlapped = False
         tuple2 = (location, width, height)
-        for rock in self.rock_set:
-            tuple1 = (rock.loc, rock.size[0], rock.size[1])
-            overlapped = overlap_checker(tuple1, tuple2)
-            if overlapped == True:
-                return False
-        for path_rectangle in self.pathcorner_objects:
-            tuple1 = path_rectangle
-            overlapped = overlap_checker(tuple1, tuple2)
-            if overlapped == True:
-                return False
-        
-        for demon in self.demon_set:
-            centre, width, height = demon.loc, width, height
-            tuple1 = (centre, width, height)
-            overlapped = overlap_checker(tuple1, tuple2)
-            if overlapped == True:
+        # Rocks and path rectangles in the cells the formation would cover
+        candidates = set()
+        for cell in grid_cells((location[0] - width/2, location[1] - height/2), (location[0] + width/2, location[1] + height/2), 1):
+            if cell in self.blocker_grid:
+                candidates.update(self.blocker_grid[cell])
+        for tuple1 in candidates:
+            if overlap_checker(tuple1, tuple2):
                 return False
-        for VHS in self.VHS_set:
-            centre, width, height = VHS.loc, width, height
-            tuple1 = (centre, width, height)
-            overlapped = overlap_checker(tuple1, tuple2)
-            if overlapped == True:
-                return False
-        
-        for keeper2 in self.zookeeper_set:
-            centre, width, height = keeper2.get_location(), width, height
-            tuple1 = (centre, width, height)
-            overlapped = overlap_checker(tuple1, tuple2)
-            if overlapped == True:
-                return False
-        
-        return not overlapped
-        
+        # Placed demons, VHS cassettes and zookeepers are checked with the same width and
+        # height as the new formation, so they block it if their centre is within that
+        if self.num_placed != len(self.demon_set) + len(self.VHS_set) + len(self.zookeeper_set):
+            self.rebuild_placed()
+        for cell in grid_cells((location[0] - width, location[1] - height), (location[0] + width, location[1] + height), 1):
+            if cell in self.placed_grid:
+                for centre in self.placed_grid[cell]:
+                    if overlap_checker((centre, width, height), tuple2):
+                        return False
+        return True
+
+    def placeability_bitmap(self, width, height):
+        """
+        This function will return a bitmap of where a formation of the given width and
+        height could be placed right now: a list of rows, one per y coordinate of the
+        board, where row[x] is 1 if formation_placeable would allow the location (x, y)
+        and 0 if not. The bitmap is cached until a formation is placed, so do not modify it.
+        """
+        if self.num_placed != len(self.demon_set) + len(self.VHS_set) + len(self.zookeeper_set):
+            self.rebuild_placed()
+        if (width, height) in self.placeability_cache:
+            return self.placeability_cache[(width, height)]
+        bitmap = [bytearray(b'\x01') * self.width for y in range(self.height)]
+        # Every blocker rules out the locations where a formation of this size would overlap
+        # it, the blocker grown by the formation's footprint
+        blockers = [(rock.loc, rock.size[0], rock.size[1]) for rock in self.rock_set]
+        blockers.extend(self.pathcorner_objects)
+        # Placed formations are checked with the new formation's own width and height
+        for formation in list(self.demon_set) + list(self.VHS_set) + list(self.zookeeper_set):
+            blockers.append((formation.loc, width, height))
+        for centre, blocker_width, blocker_height in blockers:
+            x_low, x_high = overlap_range(centre[0], blocker_width, width, self.width)
+            y_low, y_high = overlap_range(centre[1], blocker_height, height, self.height)
+            if x_low < x_high:
+                zeros = bytes(x_high - x_low)
+                for y in range(y_low, y_high):
+                    bitmap[y][x_low:x_high] = zeros
+        self.placeability_cache[(width, height)] = bitmap
+        return bitmap
+
+    def placeability_bitmap_for(self, formation_type):
+        """
+        This function will return the placeability_bitmap for a formation type, one of
+        'Demon', 'VHS' or the name of a zookeeper type.
+        """
+        if formation_type == "Demon":
+            return self.placeability_bitmap(self.demon_width, self.demon_height)
+        if formation_type == "VHS":
+            return self.placeability_bitmap(self.VHS_width, self.VHS_height)
+        return self.placeability_bitmap(Constants.KEEPER_WIDTH, Constants.KEEPER_HEIGHT)
+
     def timestep(self, mouse=None):
         """Simulates the evolution of the game by one timestep.
 
@@ -367,13 +479,11 @@ class Game:
         # The animal speed should go back to normal if it is no longer in the radius 
         
         # 1. Compute the new speed of animals based on the presence of nearby VHS cassettes or demons.
-        for animal in self.animal_set.copy():
-            for demon in self.demon_set.copy():
-                if distance(animal.loc, demon.loc) <= demon.range_radius:
-                    animal.animal_speed *= demon.speed_multiplier
-            for vhs_cassette in self.VHS_set.copy():
-                if distance(animal.loc, vhs_cassette.loc) <= vhs_cassette.range_radius:
-                    animal.animal_speed *= vhs_cassette.speed_multiplier
+        # Animals always sit on a path coordinate, so their multiplier is looked up by path index.
+        if self.num_slowdowns != len(self.demon_set) + len(self.VHS_set):
+            self.rebuild_slowdowns()
+        for animal in self.animal_set:
+            animal.animal_speed *= self.path_speed_multipliers[animal.locindex]
             
             
             
@@ -394,9 +504,14 @@ class Game:
         # 3. Handle any food-animal collisions, and remove the fed animals and eaten food.
         foods_to_remove = set()
         animals_to_remove = set()
+        # Hash the animals into a grid of cells at least as big as any food or animal,
+        # so each food only needs checking against the animals in its own and the
+        # neighbouring cells.
+        cell_size = max([0] + [food.size[0] for food in self.food_set] + [animal.size[0] for animal in self.animal_set]) + 1
+        animal_grid = spatial_hash(self.animal_set, cell_size)
         for food in self.food_set.copy():
             food_tuple = (food.loc, food.size[0], food.size[0])
-            for animal in self.animal_set.copy():
+            for animal in nearby_formations(animal_grid, food.loc, cell_size):
                 animal_tuple = (animal.loc, animal.size[0], animal.size[0])
                 # Check if any collisions
                 if overlap_checker(food_tuple, animal_tuple):
@@ -422,44 +537,42 @@ class Game:
                     zookeeper.upgrade(self.gameclock)
         # 5. Throw new food if possible.
         
+        # Sorted path indices of the animals, built the first time a zookeeper needs them
+        animal_indices = None
         # You iterate over the zookeepers
         for zookeeper in self.zookeeper_set:
             if zookeeper.aim_dir != None and not isinstance(zookeeper, CrazyZookeeper):
             # Check if the zookeeper should be throwing at this timestep
                 if (self.gameclock - zookeeper.timewhenplaced) % zookeeper.throw_interval == 0:
-                    for animal in self.animal_set:
+                    if animal_indices is None:
+                        animal_indices = sorted(animal.locindex for animal in self.animal_set)
+                    # Check if any animal in line of sight
+                    if self.animal_in_sight(zookeeper, animal_indices):
+                        # Throw food
+                        texture = Constants.TEXTURES["food"]
+                        size = (Constants.FOOD_WIDTH, Constants.FOOD_WIDTH)
+                        food_item = Food(zookeeper.loc, texture, size, zookeeper.throw_speed, zookeeper.aim_dir)
+                        self.food_set.add(food_item)
+                        # Use dictionary mapping each food item thrown to the zookeeper that threw it
+                        self.food_keeper[food_item] = zookeeper
+            elif zookeeper.aim_dir != None and isinstance(zookeeper, CrazyZookeeper):
+                if not zookeeper.asleep:
+                    # If it's awake, you want to throw food the same way as usual but also increase its throw count
+                    if (self.gameclock - zookeeper.timewhenplaced) % zookeeper.throw_interval == 0:
+                        if animal_indices is None:
+                            animal_indices = sorted(animal.locindex for animal in self.animal_set)
                         # Check if any animal in line of sight
-                        if los_intersects(animal.loc, animal.size[0], zookeeper.loc, zookeeper.aim_dir):
+                        if self.animal_in_sight(zookeeper, animal_indices):
                             # Throw food
                             texture = Constants.TEXTURES["food"]
                             size = (Constants.FOOD_WIDTH, Constants.FOOD_WIDTH)
-#                            print ("Added Food")
                             food_item = Food(zookeeper.loc, texture, size, zookeeper.throw_speed, zookeeper.aim_dir)
                             self.food_set.add(food_item)
                             # Use dictionary mapping each food item thrown to the zookeeper that threw it
                             self.food_keeper[food_item] = zookeeper
-                            break
-                        pass
-            elif zookeeper.aim_dir != None and isinstance(zookeeper, CrazyZookeeper):
-                if not zookeeper.asleep:
-                    # If it's awake, you want to throw food the same way as usual but also increase its throw count
-                    if (self.gameclock - zookeeper.timewhenplaced) % zookeeper.throw_interval == 0:
-                        for animal in self.animal_set:
-                            # Check if any animal in line of sight
-                            if los_intersects(animal.loc, animal.size[0], zookeeper.loc, zookeeper.aim_dir):
-                                # Throw food
-                                texture = Constants.TEXTURES["food"]
-                                size = (Constants.FOOD_WIDTH, Constants.FOOD_WIDTH)
-    #                            print ("Added Food")
-                                food_item = Food(zookeeper.loc, texture, size, zookeeper.throw_speed, zookeeper.aim_dir)
-                                self.food_set.add(food_item)
-                                # Use dictionary mapping each food item thrown to the zookeeper that threw it
-                                self.food_keeper[food_item] = zookeeper
-                                zookeeper.throw_count += 1
-                                if zookeeper.throw_count%Constants.CRAZY_ENDURANCE == 0:
-                                    zookeeper.fall_asleep()
-                                break
-                            pass
+                            zookeeper.throw_count += 1
+                            if zookeeper.throw_count%Constants.CRAZY_ENDURANCE == 0:
+                                zookeeper.fall_asleep()
                 else:
                     # When the zookeeper is asleep, you want to increase the time since asleep by 1
                     zookeeper.timeasleep += 1
@@ -538,6 +651,8 @@ class Game:
                         self.formation_selected.set_location(mouse)
                         self.money_left -= self.formation_selected.price
                         self.demon_set.add(self.formation_selected)
+                        self.add_slowdown(self.formation_selected)
+                        self.add_placed(self.formation_selected)
                         self.formation_selected = None
                         
 #                    else:
@@ -548,6 +663,8 @@ class Game:
                         self.formation_selected.set_location(mouse)
                         self.money_left -= self.formation_selected.price
                         self.VHS_set.add(self.formation_selected)
+                        self.add_slowdown(self.formation_selected)
+                        self.add_placed(self.formation_selected)
                         self.formation_selected = None
 
                 
@@ -560,13 +677,14 @@ class Game:
                             self.zookeeper_placed = True
                             self.money_left -= self.formation_selected.price
                             self.zookeeper_set.add(self.formation_selected)
+                            self.add_placed(self.formation_selected)
                             self.formation_selected.set_timewhenplaced(self.gameclock + 1) 
                             
                     else:
                         # This means this is the direction the player wants the zookeeper to aim
                         if self.zookeeper_location != mouse:
                             aim_dir = unit_vectorify(self.zookeeper_location, mouse)
-                            self.formation_selected.set_aim_dir(aim_dir)
+                            self.formation_selected.set_aim_dir(aim_dir, self.pathcoordlist, self.animal_size[0])
                             self.zookeeper_placed = False
                             self.formation_selected = None
             
@@ -619,6 +737,81 @@ def overlap_helper(rectangle1, rectangle2):
 
 
 
+def grid_cells(lower, upper, margin=0):
+    """
+    This function will return the cells (i, j) of side Constants.GRID_CELL_SIZE that
+    cover the box with corners lower and upper, plus margin cells all around
+    """
+    cell_size = Constants.GRID_CELL_SIZE
+    return [(i, j) for i in range(int(lower[0] // cell_size) - margin, int(upper[0] // cell_size) + margin + 1)
+                   for j in range(int(lower[1] // cell_size) - margin, int(upper[1] // cell_size) + margin + 1)]
+
+def add_to_grid(grid, tuple1):
+    """
+    This function will add a rectangle of the form (centre, width, height) to every
+    cell of grid that it covers
+    """
+    centre, width, height = tuple1[0], tuple1[1], tuple1[2]
+    for cell in grid_cells((centre[0] - width/2, centre[1] - height/2), (centre[0] + width/2, centre[1] + height/2)):
+        if cell in grid:
+            grid[cell].append(tuple1)
+        else:
+            grid[cell] = [tuple1]
+
+def overlap_range(centre, blocker_size, size, limit):
+    """
+    This function will return the range [low, high) of whole-number coordinates x in
+    [0, limit) where, along one axis, a formation of the given size centred at x overlaps
+    a blocker of blocker_size centred at centre, with the same strict inequalities as
+    overlap_helper
+    """
+    # The corners exactly as overlap_checker computes them
+    blocker_low = centre + (-1*blocker_size)/2
+    blocker_high = centre + blocker_size/2
+    def overlaps(x):
+        return blocker_low < x + size/2 and x + (-1*size)/2 < blocker_high
+    # floor(a) is -ceil(-a); start from the real-number bounds, then step to the exact ones
+    low = -ceil(-(blocker_low - size/2)) + 1
+    high = ceil(blocker_high + size/2)
+    while overlaps(low - 1):
+        low -= 1
+    while low < high and not overlaps(low):
+        low += 1
+    while overlaps(high):
+        high += 1
+    while high > low and not overlaps(high - 1):
+        high -= 1
+    return max(low, 0), min(high, limit)
+
+def spatial_hash(formations, cell_size):
+    """
+    This function will sort formations into square cells of side cell_size by
+    their centre, returning a dictionary mapping each cell (i, j) to the list of
+    formations in it
+    """
+    grid = {}
+    for formation in formations:
+        cell = (formation.loc[0] // cell_size, formation.loc[1] // cell_size)
+        if cell in grid:
+            grid[cell].append(formation)
+        else:
+            grid[cell] = [formation]
+    return grid
+
+def nearby_formations(grid, location, cell_size):
+    """
+    This function will return the formations of a spatial_hash grid in the cell
+    containing location and the 8 cells around it. If cell_size is at least as big
+    as two formations, they can only overlap when one is nearby the other.
+    """
+    i, j = location[0] // cell_size, location[1] // cell_size
+    nearby = []
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            if (i + di, j + dj) in grid:
+                nearby.extend(grid[(i + di, j + dj)])
+    return nearby
+
 def distance(loc1, loc2):
     """
     This function will calculate the distance between two locations (w1, h1) and (w2, h2)
@@ -654,12 +847,22 @@ class Formation:
         return render_dict
 #    def food_location_updater()
 class Zookeeper(Formation):
+    # Runs [start, end] of the path indices in line of sight once aimed, and the indices
+    # where the line of sight could not be worked out (see los_path_runs)
+    visible_runs = None
+    unsure_indices = frozenset()
     def __init__(self, texture, size):
         self.texture = texture
         self.size = size
         self.aim_dir = None
-    def set_aim_dir(self, aim_dir):
+    def set_aim_dir(self, aim_dir, pathcoordlist=None, animal_thickness=None):
         self.aim_dir = aim_dir
+        # Animals only ever stand on the path, so work out once which path indices are in sight
+        # (a keeper that was never placed has no location to look from)
+        if pathcoordlist is None or not hasattr(self, 'loc'):
+            self.visible_runs = None
+        else:
+            self.visible_runs, self.unsure_indices = los_path_runs(pathcoordlist, animal_thickness, self.loc, aim_dir)
     def get_aim_dir(self):
         return self.aim_dir
     def set_location(self, loc):
@@ -890,6 +1093,28 @@ def los_intersects(animal_location, animal_thickness, zookeeper_location, zookee
     
     
     return False
+def los_path_runs(pathcoordlist, animal_thickness, zookeeper_location, zookeeper_aim_dir):
+    """
+    This function will find which path coordinates an animal of a given thickness would
+    be in the zookeeper's line of sight at. It returns the list of runs [start, end] of
+    consecutive path indices in sight, and the set of indices where los_intersects
+    raised an error, which have to be checked again whenever an animal is there.
+    """
+    runs = []
+    unsure_indices = set()
+    for i in range(len(pathcoordlist)):
+        try:
+            in_sight = los_intersects(pathcoordlist[i], animal_thickness, zookeeper_location, zookeeper_aim_dir)
+        except (ValueError, ZeroDivisionError):
+            unsure_indices.add(i)
+            continue
+        if in_sight:
+            if runs and runs[-1][1] == i - 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+    return runs, unsure_indices
+
 if __name__ == '__main__':
     path_corners = [(0,350), (200, 350), (200,150), (400, 150), (400,300),  (640, 300)]
     pathcoordlist = othergenpath(path_corners)